@@ -9,15 +9,29 @@ from equality import Equality
 
 
 class Statement(Equality):
-    pass
+    __slots__ = ()
 
 
 class Aexp(Equality):
-    pass
+    __slots__ = ()
 
 
 class Bexp(Equality):
-    pass
+    __slots__ = ()
+
+
+def children(node):
+    """
+        返回节点的直接子节点，供遍历语法树的各种 pass 使用
+    """
+    result = []
+    for name in ('left', 'right', 'exp', 'aexp', 'first', 'second',
+                 'condition', 'true_stmt', 'false_stmt', 'body'):
+        child = getattr(node, name, None)
+        if child is not None:
+            result.append(child)
+    result.extend(getattr(node, 'statements', ()))
+    return result
 
 
 """
@@ -27,6 +41,8 @@ class Bexp(Equality):
 
 
 class IntAexp(Aexp):
+    __slots__ = ('i',)
+
     # 看到，我们要求构造函数中传入的就是 int，而不是 string
     def __init__(self, i):
         self.i = i
@@ -39,6 +55,8 @@ class IntAexp(Aexp):
 
 
 class VarAexp(Aexp):
+    __slots__ = ('name',)
+
     def __init__(self, name):
         self.name = name
 
@@ -62,6 +80,8 @@ arith_binops = {
 
 
 class BinopAexp(Aexp):
+    __slots__ = ('op', 'left', 'right')
+
     def __init__(self, op, left, right):
         self.op = op
         self.left = left
@@ -94,6 +114,8 @@ boolean_relops = {
 
 
 class RelopBexp(Bexp):
+    __slots__ = ('op', 'left', 'right')
+
     def __init__(self, op, left, right):
         self.op = op
         self.left = left
@@ -113,6 +135,8 @@ class RelopBexp(Bexp):
 
 
 class AndBexp(Bexp):
+    __slots__ = ('left', 'right')
+
     def __init__(self, left, right):
         self.left = left
         self.right = right
@@ -127,6 +151,8 @@ class AndBexp(Bexp):
 
 
 class OrBexp(Bexp):
+    __slots__ = ('left', 'right')
+
     def __init__(self, left, right):
         self.left = left
         self.right = right
@@ -141,6 +167,8 @@ class OrBexp(Bexp):
 
 
 class NotBexp(Bexp):
+    __slots__ = ('exp',)
+
     def __init__(self, exp):
         self.exp = exp
 
@@ -158,6 +186,8 @@ class NotBexp(Bexp):
 
 
 class AssignStatement(Statement):
+    __slots__ = ('name', 'aexp')
+
     def __init__(self, name, aexp):
         self.name = name
         self.aexp = aexp
@@ -172,6 +202,8 @@ class AssignStatement(Statement):
 
 
 class CompoundStatement(Statement):
+    __slots__ = ('first', 'second')
+
     def __init__(self, first, second):
         self.first = first
         self.second = second
@@ -184,7 +216,28 @@ class CompoundStatement(Statement):
         self.second.eval(env)
 
 
+class Block(Statement):
+    """
+        语句序列 a; b; c 的扁平表示，直接保存语句的 list，
+        而不是左递归折叠出来的层层嵌套的 CompoundStatement，
+        这样语句再多，eval 和 __repr__ 也不会递归得很深
+    """
+    __slots__ = ('statements',)
+
+    def __init__(self, statements):
+        self.statements = statements
+
+    def __repr__(self):
+        return 'Block([%s])' % ', '.join(repr(statement) for statement in self.statements)
+
+    def eval(self, env):
+        for statement in self.statements:
+            statement.eval(env)
+
+
 class IfStatement(Statement):
+    __slots__ = ('condition', 'true_stmt', 'false_stmt')
+
     def __init__(self, condition, true_stmt, false_stmt):
         self.condition = condition
         self.true_stmt = true_stmt
@@ -203,6 +256,8 @@ class IfStatement(Statement):
 
 
 class WhileStatement(Statement):
+    __slots__ = ('condition', 'body')
+
     def __init__(self, condition, body):
         self.condition = condition
         self.body = body
@@ -216,3 +271,21 @@ class WhileStatement(Statement):
             self.body.eval(env)
             # 再次评估条件
             condition_value = self.condition.eval(env)
+
+
+class ChargeStatement(Statement):
+    """
+        执行预算的计费点：budget.instrument 把它插到每个语句序列的开头，
+        每执行一次就向 budget 计入 steps 步，超出预算时由 budget 抛出 BudgetExceeded
+    """
+    __slots__ = ('budget', 'steps')
+
+    def __init__(self, budget, steps):
+        self.budget = budget
+        self.steps = steps
+
+    def __repr__(self):
+        return 'ChargeStatement(%d)' % self.steps
+
+    def eval(self, env):
+        self.budget.charge(self.steps)
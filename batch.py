@@ -0,0 +1,145 @@
+# encoding: utf-8
+
+import argparse
+import json
+import os
+import sys
+from functools import partial
+from multiprocessing import Pool
+
+import closures
+import iterative
+from budget import Budget, execute
+import slots
+import vm
+from recovery import check, parse
+
+"""
+    批量执行大量互相独立的 Imp 程序：lex、parse、eval 分散到进程池中
+    程序是 (name, source) 对，按 chunksize 一批批地分给各个 worker，
+    结果按提交的顺序逐个返回：(name, env, None) 或者 (name, None, 错误信息)
+
+    命令行用法：
+        python batch.py programs/               # 目录中的每个文件是一个程序，按文件名排序
+        python batch.py programs.jsonl          # 每行一个 {"name": ..., "source": ...}
+        cat programs.jsonl | python batch.py -  # 从标准输入读 JSONL
+    结果以 JSONL 写到标准输出，每行 {"name": ..., "env": {...}} 或 {"name": ..., "error": "..."}
+    --steps / --seconds 给每个程序设置执行预算，死循环的程序不会一直占着 worker
+    --check 只检查语法，不执行：每行 {"name": ..., "errors": [...]}，列出每个程序的全部 lex 和 parse 错误
+"""
+
+engines = {
+    'ast': lambda ast, env: ast.eval(env),
+    'iterative': iterative.execute,
+    'closures': lambda ast, env: closures.compile_stmt(ast)(env),
+    'slots': lambda ast, env: slots.SlotProgram(ast).eval(env),
+    'vm': lambda ast, env: vm.compile_program(ast).eval(env),
+}
+
+
+def evaluate(program, engine='ast', steps=None, seconds=None):
+    """
+        在当前进程中执行一个程序，返回 (name, env, error)
+        steps / seconds 是每个程序的执行预算 (见 budget.py)，超出预算的程序返回 BudgetExceeded 错误
+        lex 和 parse 错误是 LexError / ParseError，错误信息中有行号和列号
+    """
+    name, source = program
+    try:
+        ast = parse(source)
+        env = {}
+        if steps is None and seconds is None:
+            engines[engine](ast, env)
+        else:
+            execute(ast, env, Budget(steps, seconds), engine)
+        return name, env, None
+    except Exception as error:
+        return name, None, '%s: %s' % (error.__class__.__name__, error)
+
+
+def validate(program):
+    """
+        只检查语法，返回 (name, None, errors)，errors 是全部错误信息的 list，没有错误时为 None
+    """
+    name, source = program
+    _, errors = check(source)
+    return name, None, ['%s: %s' % (error.__class__.__name__, error) for error in errors] or None
+
+
+def run_batch(programs, workers=None, chunksize=32, engine='ast', steps=None, seconds=None,
+              validate_only=False):
+    """
+        programs 是 (name, source) 的可迭代对象，逐个 yield (name, env, error)，顺序与 programs 相同
+        workers 为 None 时使用 CPU 个数，为 1 时直接在当前进程中执行
+        validate_only 为真时不执行，每个程序的结果是 validate 的 (name, None, errors)
+    """
+    if validate_only:
+        task = validate
+    else:
+        task = partial(evaluate, engine=engine, steps=steps, seconds=seconds)
+    if workers == 1:
+        for program in programs:
+            yield task(program)
+        return
+    pool = Pool(workers)
+    try:
+        for outcome in pool.imap(task, programs, chunksize):
+            yield outcome
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def read_directory(directory):
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            with open(path) as file:
+                yield name, file.read()
+
+
+def read_jsonl(file):
+    """
+        每行是 {"name": ..., "source": ...}，没有 name 时以行号为 name；也可以直接是源码字符串
+    """
+    for number, line in enumerate(file, 1):
+        line = line.strip()
+        if not line:
+            continue
+        record = json.loads(line)
+        if isinstance(record, dict):
+            yield record.get('name', number), record['source']
+        else:
+            yield number, record
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Evaluate many Imp programs in a process pool')
+    parser.add_argument('source', help='directory of programs, JSONL file, or - for stdin')
+    parser.add_argument('-w', '--workers', type=int, default=None)
+    parser.add_argument('-c', '--chunksize', type=int, default=32)
+    parser.add_argument('-e', '--engine', choices=sorted(engines), default='ast')
+    parser.add_argument('--steps', type=int, default=None, help='step budget per program')
+    parser.add_argument('--seconds', type=float, default=None, help='time budget per program')
+    parser.add_argument('--check', action='store_true', help='only report lex and parse errors')
+    args = parser.parse_args(argv)
+
+    if args.source == '-':
+        programs = read_jsonl(sys.stdin)
+    elif os.path.isdir(args.source):
+        programs = read_directory(args.source)
+    else:
+        programs = read_jsonl(open(args.source))
+    for name, env, error in run_batch(programs, args.workers, args.chunksize, args.engine,
+                                      args.steps, args.seconds, args.check):
+        if args.check:
+            record = {'name': name, 'errors': error or []}
+        elif error is None:
+            record = {'name': name, 'env': env}
+        else:
+            record = {'name': name, 'error': error}
+        sys.stdout.write(json.dumps(record, sort_keys=True) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,632 @@
+# encoding: utf-8
+
+"""
+    性能测试脚本，用法：
+        python benchmark.py            # 运行全部测试
+        python benchmark.py lexer      # 只运行指定的测试
+"""
+
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from multiprocessing import cpu_count
+
+import batch
+import budget
+import cache
+import closedform
+import closures
+import cooperative
+import generator
+import hoist
+import incremental
+import lexer
+import optimizer
+import primitive
+import recovery
+import slots
+import vectorized
+import vm
+from equality import Equality
+
+
+def best_of(func, repeat=3):
+    """
+        运行 func 若干次，返回最短的一次耗时 (秒)
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def sample_source(size):
+    """
+        把 imp_spec 重复拼接成大约 size 字节的源码
+    """
+    with open('imp_spec') as file:
+        unit = file.read().rstrip() + ' ;\n# filler comment\n'
+    return unit * (size // len(unit) + 1)
+
+
+def bench_lexer():
+    """
+        对比逐位置遍历 pattern 的 lexer.lex 和单次扫描的 Scanner 的吞吐量 (MB/s)
+    """
+    characters = sample_source(1024 * 1024)
+    megabytes = len(characters) / (1024.0 * 1024.0)
+    assert lexer.lex(characters, lexer.token_exprs) == lexer.imp_lex(characters)
+
+    loop = best_of(lambda: lexer.lex(characters, lexer.token_exprs), 1)
+    scanner = best_of(lambda: lexer.imp_lex(characters))
+    print 'lexer: %.2f MB' % megabytes
+    print '  lex loop: %8.2f MB/s' % (megabytes / loop)
+    print '  scanner:  %8.2f MB/s (x%.1f)' % (megabytes / scanner, loop / scanner)
+
+
+def bench_packrat():
+    """
+        多层括号的条件表达式，对比普通解析和 packrat 解析的耗时
+    """
+    sys.setrecursionlimit(100000)
+    print 'packrat: if ((...(x < 1)...)) then x := 1 end'
+    for depth in (4, 8, 16, 32):
+        source = 'if ' + '(' * depth + 'x < 1' + ')' * depth + ' then x := 1 end'
+        tokens = lexer.imp_lex(source)
+        plain = best_of(lambda: primitive.imp_parse(tokens))
+        primitive.memo_table.reset()
+        packrat = best_of(lambda: primitive.imp_parse(tokens, packrat=True))
+        table = primitive.memo_table
+        print '  depth %2d: plain %.4fs  packrat %.4fs  hit rate %.2f  table size %d' % \
+            (depth, plain, packrat, table.hit_rate(), table.size)
+
+
+def bench_grammar():
+    """
+        小脚本的单次解析耗时：每次重新构造语法 (旧的做法) 和使用缓存的语法图
+    """
+    sources = ['x := 1', 's := 4 ; t := s - 5', 'if x < 10 then y := x * 2 else y := 0 end']
+    token_lists = [lexer.imp_lex(source) for source in sources]
+    count = 2000
+
+    def parse(rebuild):
+        for _ in range(count):
+            for tokens in token_lists:
+                if rebuild:
+                    primitive.rules.clear()
+                    primitive.grammars.clear()
+                primitive.imp_parse(tokens)
+
+    rebuilt = best_of(lambda: parse(True)) / (count * len(sources))
+    cached = best_of(lambda: parse(False)) / (count * len(sources))
+    print 'grammar: per-parse cost of small scripts'
+    print '  rebuild each parse: %8.1f us' % (rebuilt * 1e6)
+    print '  cached grammar:     %8.1f us (x%.1f)' % (cached * 1e6, rebuilt / cached)
+
+
+loop_program = '''
+    n := 100000;
+    i := 0;
+    s := 0;
+    while i < n do
+        s := s + i * 2 - (i / 3);
+        if s > 1000000 then s := s - 1000000 end;
+        i := i + 1
+    end
+'''
+
+
+def parse_program(text):
+    return primitive.imp_parse(lexer.imp_lex(text)).value
+
+
+def bench_closures():
+    """
+        循环程序：tree-walking 的 ast.eval 和编译为闭包之后的执行时间
+    """
+    ast = parse_program(loop_program)
+    expected = {}
+    ast.eval(expected)
+    compiled = closures.compile_stmt(ast)
+    env = {}
+    compiled(env)
+    assert env == expected
+
+    walking = best_of(lambda: ast.eval({}), 1)
+    closure = best_of(lambda: compiled({}))
+    print 'closures: loop program, 100000 iterations'
+    print '  ast.eval: %.3fs' % walking
+    print '  closures: %.3fs (x%.1f)' % (closure, walking / closure)
+
+
+def bench_slots():
+    """
+        槽位模式与 dict env 的闭包对比：执行时间，以及一份程序状态占用的内存
+    """
+    ast = parse_program(loop_program)
+    compiled = closures.compile_stmt(ast)
+    program = slots.SlotProgram(ast)
+    env = {}
+    compiled(env)
+    values = program.run()
+    assert program.as_dict(values) == env
+
+    closure = best_of(lambda: compiled({}))
+    slot = best_of(program.run)
+    print 'slots: loop program, 100000 iterations'
+    print '  dict env closures: %.3fs' % closure
+    print '  slot closures:     %.3fs (x%.1f)' % (slot, closure / slot)
+    print '  state size: dict %d bytes, list %d bytes' % (sys.getsizeof(env), sys.getsizeof(values))
+
+
+def bench_vm():
+    """
+        同一个循环程序在各种执行方式下的耗时：ast.eval、闭包、槽位闭包、字节码虚拟机
+    """
+    ast = parse_program(loop_program)
+    expected = {}
+    ast.eval(expected)
+    program = vm.compile_program(ast)
+    assert program.as_dict(program.run()) == expected
+
+    compiled = closures.compile_stmt(ast)
+    slot_program = slots.SlotProgram(ast)
+    walking = best_of(lambda: ast.eval({}), 1)
+    print 'vm: loop program, 100000 iterations, %d instructions' % (len(program.code) // 4)
+    print '  ast.eval: %.3fs' % walking
+    for name, run in [('closures', lambda: compiled({})),
+                      ('slots', slot_program.run),
+                      ('vm', program.run)]:
+        elapsed = best_of(run)
+        print '  %-8s: %.3fs (x%.1f)' % (name, elapsed, walking / elapsed)
+
+
+def deep_size(root):
+    """
+        root 引用到的全部对象的 sys.getsizeof 之和，每个对象只算一次
+    """
+    seen = set()
+    size = 0
+    stack = [root]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, (list, tuple)):
+            stack.extend(obj)
+        elif isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, Equality):
+            stack.extend(getattr(obj, name) for name in obj.fields())
+        elif hasattr(obj, '__dict__'):
+            stack.append(obj.__dict__)
+    return size
+
+
+class DictNode:
+    """
+        带 __dict__ 的节点，与改为 __slots__ 之前的语法树节点占用的内存相同
+    """
+    pass
+
+
+def dict_copy(node):
+    if isinstance(node, list):
+        return [dict_copy(item) for item in node]
+    if not isinstance(node, Equality):
+        return node
+    copy = DictNode()
+    for name in node.fields():
+        setattr(copy, name, dict_copy(getattr(node, name)))
+    return copy
+
+
+def bench_memory():
+    """
+        大程序的 token 和语法树占用的内存：
+        token 对比不共享的 lexer.lex 和共享 token 的 imp_lex，语法树对比 __dict__ 节点和 __slots__ 节点
+        另外用 resource 的 ru_maxrss 给出 parse 时峰值内存的增长 (Linux 上单位是 KB)
+        这个脚本用 print 语句，只能在 Python 2 下运行，没有 tracemalloc 可用
+    """
+    source = generator.generate(0, statements=20000)
+    plain_tokens = lexer.lex(source, lexer.token_exprs)
+    tokens = lexer.imp_lex(source)
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    ast = primitive.imp_parse(tokens).value
+    parse_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+    print 'memory: %d tokens, %d nodes' % (len(tokens), optimizer.count_nodes(ast))
+    print '  tokens: tuples %8d KB, shared %8d KB' % (deep_size(plain_tokens) // 1024,
+                                                       deep_size(tokens) // 1024)
+    print '  ast:    __dict__ %6d KB, __slots__ %6d KB' % (deep_size(dict_copy(ast)) // 1024,
+                                                           deep_size(ast) // 1024)
+    print '  ru_maxrss: parse peak +%d KB' % parse_peak
+
+
+def bench_cache():
+    """
+        解析缓存：冷启动 (lex + parse)、内存命中、进程重启后从磁盘读取 (warm restart) 的单次耗时
+    """
+    sources = [generator.generate(seed, statements=200) for seed in range(20)]
+    directory = tempfile.mkdtemp()
+    try:
+        def run(make_cache):
+            parse_cache = make_cache()
+            for text in sources:
+                parse_cache.parse(text)
+            return parse_cache
+
+        count = len(sources)
+        cold = best_of(lambda: run(cache.ParseCache)) / count
+        warm_cache = run(cache.ParseCache)
+        warm = best_of(lambda: run(lambda: warm_cache)) / count
+        run(lambda: cache.ParseCache(directory=directory))
+        restart = best_of(lambda: run(lambda: cache.ParseCache(directory=directory))) / count
+        small = run(lambda: cache.ParseCache(capacity=count // 2))
+        run(lambda: small)
+        print 'cache: %d generated programs, 200 statements each' % count
+        print '  cold (lex + parse): %8.1f us' % (cold * 1e6)
+        print '  memory hit:         %8.1f us (x%.0f)' % (warm * 1e6, cold / warm)
+        print '  disk (restart):     %8.1f us (x%.1f)' % (restart * 1e6, cold / restart)
+        print '  capacity %d: %r' % (small.capacity, small)
+    finally:
+        shutil.rmtree(directory)
+
+
+def bench_incremental():
+    """
+        大程序中修改一个数字：完整的 lex + parse 和增量的 Document.edit 的单次耗时
+    """
+    source = generator.generate(0, statements=2000)
+    document = incremental.Document(source)
+    digits = [index for index, char in enumerate(source) if char.isdigit()]
+    offsets = digits[::len(digits) // 10][:10]
+
+    def full():
+        for offset in offsets:
+            text = source[:offset] + '7' + source[offset + 1:]
+            primitive.imp_parse(lexer.imp_lex(text))
+
+    def edit():
+        for offset in offsets:
+            document.edit(offset, 1, '7')
+
+    count = len(offsets)
+    whole = best_of(full, 1) / count
+    partial = best_of(edit) / count
+    print 'incremental: %d tokens, %d top-level statements' % \
+        (len(document.tokens), len(document.statements))
+    print '  full lex + parse: %8.2f ms' % (whole * 1e3)
+    print '  Document.edit:    %8.2f ms (x%.0f)' % (partial * 1e3, whole / partial)
+
+
+def bench_batch():
+    """
+        批量执行生成的程序：不同 worker 个数下每秒执行的程序数
+    """
+    programs = [(seed, generator.generate(seed, statements=20)) for seed in range(400)]
+    expected = list(batch.run_batch(programs, workers=1))
+    assert all(error is None for _, _, error in expected)
+    single = best_of(lambda: list(batch.run_batch(programs, workers=1)), 1)
+    print 'batch: %d programs, %d cpus' % (len(programs), cpu_count())
+    print '  in process: %6.0f programs/s' % (len(programs) / single)
+    for workers in sorted(set([1, 2, 4, cpu_count()])):
+        results = []
+        elapsed = best_of(lambda: results.append(list(batch.run_batch(programs, workers=workers))), 1)
+        assert results[-1] == expected
+        print '  %2d workers: %6.0f programs/s (x%.1f)' % \
+            (workers, len(programs) / elapsed, single / elapsed)
+
+
+def bench_budget():
+    """
+        循环程序在有执行预算 (步数和时间都限制) 时的额外开销
+    """
+    ast = parse_program(loop_program)
+    expected = {}
+    ast.eval(expected)
+    print 'budget: loop program, 100000 iterations'
+    for engine in ('ast', 'closures', 'slots', 'vm'):
+        limited = budget.Budget(steps=10 ** 9, seconds=60)
+        assert budget.execute(ast, {}, limited, engine) == expected
+        plain = best_of(lambda: batch.engines[engine](ast, {}))
+        checked = best_of(lambda: budget.execute(ast, {}, limited, engine))
+        print '  %-8s: %.3fs, with budget %.3fs (%+.0f%%), %d steps' % \
+            (engine, plain, checked, (checked / plain - 1) * 100, limited.steps)
+
+
+def bench_trace():
+    """
+        跟踪模式下解析一个生成的程序，列出自身耗时最多的规则，以及跟踪本身的开销
+    """
+    tokens = lexer.imp_lex(generator.generate(0, statements=500))
+    plain = best_of(lambda: primitive.imp_parse(tokens))
+    primitive.parse_trace.reset()
+    traced = best_of(lambda: primitive.imp_parse(tokens, trace=True), 1)
+    print 'trace: %d tokens, plain %.3fs, traced %.3fs (x%.1f)' % (len(tokens), plain, traced,
+                                                                 traced / plain)
+    print primitive.parse_trace.report(6)
+
+
+def bench_precedence():
+    """
+        表达式解析：每个优先级一层 Exp 的塔和算符优先解析器 Precedence，每秒解析的 token 数
+    """
+    sys.setrecursionlimit(100000)
+    rng = random.Random(0)
+
+    def expression(depth):
+        if depth == 0:
+            return rng.choice(['x', 'y', str(rng.randint(0, 99))])
+        parts = [expression(depth - 1) if rng.random() < 0.3 else rng.choice(['x', '7'])
+                 for _ in range(rng.randint(2, 5))]
+        text = parts[0]
+        for part in parts[1:]:
+            text += ' %s %s' % (rng.choice('+-*/'), part)
+        return '(' + text + ')'
+
+    sources = [('flat', ' + '.join('x * %d' % i for i in range(2000))),
+               ('nested', ' + '.join(expression(4) for _ in range(100)))]
+    # 括号中的表达式也要用塔来解析
+    group = primitive.keyword('(') + primitive.Lazy(lambda: tower_exp) + primitive.keyword(')') ^ \
+        primitive.process_group
+    tower_exp = primitive.precedence_tower(primitive.aexp_value() | group,
+                                           primitive.aexp_precedence_levels, primitive.process_binop)
+    tower = primitive.Phrase(tower_exp)
+    climbing = primitive.Phrase(primitive.aexp())
+    print 'precedence: arithmetic expressions, tokens/s'
+    for name, source in sources:
+        tokens = lexer.imp_lex(source)
+        assert tower(tokens, 0).value == climbing(tokens, 0).value
+        old = best_of(lambda: tower(tokens, 0))
+        new = best_of(lambda: climbing(tokens, 0))
+        print '  %-7s %6d tokens: Exp tower %9.0f  Precedence %9.0f (x%.1f)' % \
+            (name, len(tokens), len(tokens) / old, len(tokens) / new, old / new)
+
+
+def bench_predict():
+    """
+        生成的程序：按顺序尝试 Alternate 分支的普通解析和按当前 token 查表的预测解析，每秒解析的 token 数
+    """
+    print 'predict: tokens/s'
+    for name, options in (('small', dict(statements=50)), ('large', dict(statements=2000)),
+                          ('deep', dict(statements=200, expr_depth=6, nesting=3))):
+        tokens = lexer.imp_lex(generator.generate(0, **options))
+        assert primitive.imp_parse(tokens).value == primitive.imp_parse(tokens, predict=True).value
+        plain = best_of(lambda: primitive.imp_parse(tokens))
+        predict = best_of(lambda: primitive.imp_parse(tokens, predict=True))
+        print '  %-6s %6d tokens: plain %9.0f  predict %9.0f (x%.1f)' % \
+            (name, len(tokens), len(tokens) / plain, len(tokens) / predict, plain / predict)
+
+
+def bench_recovery():
+    """
+        语法检查一批生成的程序，其中四分之一随机插入了错误：只用 imp_lex + imp_parse 判断对错，
+        出错即抛出异常的 recovery.parse，以及找出全部错误的 recovery.check，每秒处理的程序数
+    """
+    rng = random.Random(0)
+    corpus = []
+    for seed in range(400):
+        source = generator.generate(seed, statements=20)
+        if seed % 4 == 0:
+            offset = rng.randint(0, len(source))
+            source = source[:offset] + rng.choice([' ;', ' := ', ' end', ' $', ' if ']) + source[offset:]
+        corpus.append(source)
+
+    def plain():
+        for source in corpus:
+            try:
+                primitive.imp_parse(lexer.imp_lex(source))
+            except lexer.LexError:
+                pass
+
+    def strict():
+        for source in corpus:
+            try:
+                recovery.parse(source)
+            except ValueError:
+                pass
+
+    errors = sum(len(recovery.check(source)[1]) for source in corpus)
+    print 'recovery: %d programs, %d errors found by check' % (len(corpus), errors)
+    for name, func in (('imp_parse', plain), ('parse', strict),
+                       ('check', lambda: [recovery.check(source) for source in corpus])):
+        print '  %-9s %8.0f programs/s' % (name, len(corpus) / best_of(func))
+
+
+sweep_program = '''
+    steps := 0;
+    while n > 1 do
+        if n - n / 2 * 2 = 0 then n := n / 2 else n := 3 * n + 1 end;
+        steps := steps + 1
+    end
+'''
+
+
+def bench_vectorized():
+    """
+        参数扫描：同一个程序对 n = 1..rows 的每一行执行，逐行 ast.eval 和 numpy 向量化执行每秒执行的行数
+    """
+    if vectorized.np is None:
+        print 'vectorized: numpy is not installed, skipped'
+        return
+    ast = parse_program(sweep_program)
+    rows = 100000
+    columns = {'n': range(1, rows + 1)}
+    scalar_rows = 5000
+
+    def scalar():
+        for n in xrange(1, scalar_rows + 1):
+            ast.eval({'n': n})
+
+    assert vectorized.evaluate_batch(ast, {'n': range(1, 201)}) == \
+        [ast.eval(env) or env for env in ({'n': n} for n in range(1, 201))]
+    plain = scalar_rows / best_of(scalar, 1)
+    lanes = best_of(lambda: vectorized.run(ast, columns), 1)
+    envs = best_of(lambda: vectorized.evaluate_batch(ast, columns), 1)
+    print 'vectorized: collatz steps for n = 1..%d' % rows
+    print '  ast.eval per row:    %10.0f rows/s' % plain
+    print '  vectorized.run:      %10.0f rows/s (x%.1f)' % (rows / lanes, rows / lanes / plain)
+    print '  with per-row envs:   %10.0f rows/s (x%.1f)' % (rows / envs, rows / envs / plain)
+
+
+def bench_token_array():
+    """
+        大程序的 token：list of tuple 和 TokenArray 占用的内存，lex 和 parse 的耗时，以及 mmap 读入文件之后的 lex + parse
+    """
+    source = generator.generate(0, statements=20000)
+    tokens = lexer.imp_lex(source)
+    compact = lexer.imp_lex_array(source)
+    array_size = sum(sys.getsizeof(values) for values in (compact, compact.starts, compact.codes))
+    print 'token_array: %d tokens, source %d KB' % (len(tokens), len(source) // 1024)
+    print '  memory: list %8d KB, TokenArray %6d KB' % (deep_size(tokens) // 1024, array_size // 1024)
+    lex_list = best_of(lambda: lexer.imp_lex(source))
+    lex_array = best_of(lambda: lexer.imp_lex_array(source))
+    parse_list = best_of(lambda: primitive.imp_parse(tokens))
+    parse_array = best_of(lambda: primitive.imp_parse(compact))
+    print '  lex:    list %.3fs, TokenArray %.3fs' % (lex_list, lex_array)
+    print '  parse:  list %.3fs, TokenArray %.3fs' % (parse_list, parse_array)
+    directory = tempfile.mkdtemp()
+    try:
+        path = directory + '/program.imp'
+        with open(path, 'w') as file:
+            file.write(source)
+        mapped = best_of(lambda: primitive.imp_parse(lexer.imp_lex_file(path)))
+        print '  mmap file lex + parse %.3fs' % mapped
+    finally:
+        shutil.rmtree(directory)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def bench_cooperative():
+    """
+        长程序和短程序同时提交：逐个阻塞 ast.eval 和 cooperative.Scheduler 轮流执行时，短程序从提交到结束的延迟 p50 / p99
+    """
+    long_program = parse_program('i := 0; while i < 100000 do i := i + 1 end')
+    short_program = parse_program(generator.generate(0, statements=10))
+    # 每 50 个短程序之前有一个长程序
+    jobs = []
+    for index in range(200):
+        if index % 50 == 0:
+            jobs.append((True, long_program))
+        jobs.append((False, short_program))
+
+    def blocking():
+        start = time.time()
+        latencies = []
+        for is_long, program in jobs:
+            program.eval({})
+            if not is_long:
+                latencies.append(time.time() - start)
+        return latencies, time.time() - start
+
+    def scheduled(every, limit):
+        scheduler = cooperative.Scheduler(every, limit)
+        start = time.time()
+        tasks = [(is_long, scheduler.spawn(program)) for is_long, program in jobs]
+        scheduler.run()
+        return [task.latency for is_long, task in tasks if not is_long], time.time() - start
+
+    print 'cooperative: %d short programs and %d loops of 100000 iterations submitted together' % (
+        sum(1 for is_long, _ in jobs if not is_long), sum(1 for is_long, _ in jobs if is_long))
+    for name, (latencies, total) in [('blocking ast.eval', blocking()),
+                                     ('every=1000', scheduled(1000, None)),
+                                     ('every=100', scheduled(100, None)),
+                                     ('every=1000 limit=8', scheduled(1000, 8))]:
+        print '  %-20s p50 %8.2fms  p99 %8.2fms  total %.2fs' % (
+            name, percentile(latencies, 0.5) * 1000, percentile(latencies, 0.99) * 1000, total)
+
+
+invariant_program = """
+n := 50; s := 0; i := 0;
+while i < 20000 do
+    j := 0;
+    while j < 10 do
+        s := s + (n * n - 1) * (i + 1) + (i + 1);
+        j := j + 1
+    end;
+    i := i + 1
+end
+"""
+
+
+def bench_hoist():
+    """
+        循环不变量外提和 CSE 前后的执行时间：循环中反复计算 n * n - 1 的程序，以及 generator 生成的程序
+    """
+    ast = parse_program(invariant_program)
+    optimized, stats = hoist.optimize(ast)
+    print 'hoist: %(hoisted)d hoisted, %(eliminated)d eliminated' % stats
+    plain = best_of(lambda: ast.eval({}))
+    hoisted = best_of(lambda: optimized.eval({}))
+    print '  invariant loop: eval %.3fs, hoisted %.3fs (x%.2f)' % (plain, hoisted, plain / hoisted)
+    programs = [parse_program(generator.generate(seed, statements=30, expr_depth=4, nesting=3, iterations=20))
+                for seed in range(100)]
+    optimized = [hoist.optimize(program)[0] for program in programs]
+    plain = best_of(lambda: [program.eval({}) for program in programs])
+    hoisted = best_of(lambda: [program.eval({}) for program in optimized])
+    print '  100 generated programs: eval %.3fs, hoisted %.3fs (x%.2f)' % (plain, hoisted, plain / hoisted)
+
+
+def bench_closedform():
+    """
+        计数循环 while i < n do s := s + k; i := i + 1 end：eval 一次一次地执行和 closedform 直接算出结果的耗时
+    """
+    ast = parse_program('s := 0; i := 0; while i < n do s := s + k * i + 3; t := t + s; i := i + 1 end')
+    fast, stats = closedform.accelerate(ast)
+    assert stats['accelerated'] == 1
+    print 'closedform: s := s + k * i + 3; t := t + s; i := i + 1'
+    for n in (1000, 100000, 1000000):
+        expected = {'n': n, 'k': 7}
+        env = dict(expected)
+        plain = best_of(lambda: ast.eval(expected), 1)
+        fast.eval(env)
+        assert env == expected
+        jumped = best_of(lambda: fast.eval({'n': n, 'k': 7}))
+        print '  n = %-8d eval %8.4fs, closed form %.6fs (x%.0f)' % (n, plain, jumped, plain / jumped)
+    jumped = best_of(lambda: fast.eval({'n': 10 ** 12, 'k': 7}))
+    print '  n = 10^12    closed form %.6fs' % jumped
+
+
+benchmarks = [
+    ('lexer', bench_lexer),
+    ('packrat', bench_packrat),
+    ('grammar', bench_grammar),
+    ('closures', bench_closures),
+    ('slots', bench_slots),
+    ('vm', bench_vm),
+    ('memory', bench_memory),
+    ('cache', bench_cache),
+    ('incremental', bench_incremental),
+    ('batch', bench_batch),
+    ('budget', bench_budget),
+    ('trace', bench_trace),
+    ('precedence', bench_precedence),
+    ('predict', bench_predict),
+    ('recovery', bench_recovery),
+    ('vectorized', bench_vectorized),
+    ('token_array', bench_token_array),
+    ('cooperative', bench_cooperative),
+    ('hoist', bench_hoist),
+    ('closedform', bench_closedform),
+]
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:]
+    for name, bench in benchmarks:
+        if not names or name in names:
+            bench()
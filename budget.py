@@ -0,0 +1,163 @@
+# encoding: utf-8
+
+import time
+
+import closures
+import iterative
+import slots
+import vm
+from ast import *
+
+"""
+    执行预算：限制一个程序最多执行的步数和时间，防止死循环一直占着 worker
+
+    步数 = 执行的语句条数 + 循环的次数 (每次回到循环开头算一步)
+    为了让热循环中的开销可以忽略，不在每条语句上计数，而是由 instrument 在每个语句序列
+    (Block、if 的分支、while 的循环体、整个程序) 的开头插入一条 ChargeStatement，一次计入整个序列的条数，
+    while 的循环体再多计一步；时间也不是每次都检查，只在累计了 interval 步之后才看一次时钟
+    ChargeStatement 是普通的语句节点，所以 ast.eval、iterative、closures、slots、vm 都能直接执行插入后的语法树
+
+    用法：
+        env = {}
+        budget.execute(ast, env, Budget(steps=100000, seconds=1.0), engine='vm')
+    超出预算时抛出 BudgetExceeded，其中的 env 是此时已经执行出的变量 (部分结果)，steps 是已经执行的步数
+"""
+
+
+class BudgetExceeded(RuntimeError):
+    """
+        reason 为 'steps' 或 'time'
+    """
+    def __init__(self, reason, steps, env=None):
+        RuntimeError.__init__(self, 'budget exceeded (%s) after %d steps' % (reason, steps))
+        self.reason = reason
+        self.steps = steps
+        self.env = env
+
+
+class Budget(object):
+    """
+        steps 是最多可以执行的步数，seconds 是最多可以执行的秒数，为 None 时不限制
+        每次执行前调用 start 重新计数和计时
+    """
+    def __init__(self, steps=None, seconds=None, interval=4096):
+        self.max_steps = steps
+        self.seconds = seconds
+        self.interval = interval
+        self.steps = 0
+        self.deadline = None
+        self.next_check = 0
+
+    def start(self):
+        self.steps = 0
+        self.deadline = time.time() + self.seconds if self.seconds is not None else None
+        self.schedule()
+
+    def schedule(self):
+        """
+            下一次需要检查的步数：有时间限制时每 interval 步看一次时钟，有步数限制时刚好超出的那一步
+        """
+        next_check = float('inf')
+        if self.deadline is not None:
+            next_check = self.steps + self.interval
+        if self.max_steps is not None:
+            next_check = min(next_check, self.max_steps + 1)
+        self.next_check = next_check
+
+    def charge(self, steps):
+        self.steps += steps
+        if self.steps >= self.next_check:
+            self.check()
+
+    def check(self):
+        if self.max_steps is not None and self.steps > self.max_steps:
+            raise BudgetExceeded('steps', self.steps)
+        if self.deadline is not None and time.time() > self.deadline:
+            raise BudgetExceeded('time', self.steps)
+        self.schedule()
+
+    def __repr__(self):
+        return 'Budget(steps=%r, seconds=%r, used=%d)' % (self.max_steps, self.seconds, self.steps)
+
+
+def statements(stmt):
+    """
+        把 Block / CompoundStatement 展开为一个语句序列
+    """
+    if isinstance(stmt, Block):
+        result = []
+        for statement in stmt.statements:
+            result.extend(statements(statement))
+        return result
+    if isinstance(stmt, CompoundStatement):
+        return statements(stmt.first) + statements(stmt.second)
+    return [stmt]
+
+
+def instrument(stmt, budget, extra=0):
+    """
+        返回插入了 ChargeStatement 的新语法树，原来的语法树不变
+        stmt 作为一个语句序列执行，开头计入序列的条数再加 extra 步
+    """
+    sequence = [ChargeStatement(budget, 0)]
+    for statement in statements(stmt):
+        if isinstance(statement, IfStatement):
+            false_stmt = statement.false_stmt
+            if false_stmt:
+                false_stmt = instrument(false_stmt, budget)
+            statement = IfStatement(statement.condition,
+                                    instrument(statement.true_stmt, budget),
+                                    false_stmt)
+        elif isinstance(statement, WhileStatement):
+            statement = WhileStatement(statement.condition,
+                                       instrument(statement.body, budget, 1))
+        sequence.append(statement)
+    sequence[0].steps = len(sequence) - 1 + extra
+    return Block(sequence)
+
+
+def execute(stmt, env, budget, engine='ast'):
+    """
+        在 budget 的限制下执行 stmt，与 stmt.eval(env) 一样直接修改 env
+        engine 可以是 ast / iterative / closures / slots / vm
+    """
+    program = instrument(stmt, budget)
+    budget.start()
+    if engine in ('slots', 'vm'):
+        # 这两种方式的程序状态是 list，出错时转回 dict 作为部分结果
+        compiled = slots.SlotProgram(program) if engine == 'slots' else vm.compile_program(program)
+        values = compiled.new_env(env)
+        try:
+            if engine == 'slots':
+                compiled.code(values)
+            else:
+                vm.execute(compiled.code, values)
+        except BudgetExceeded as error:
+            error.env = compiled.as_dict(values, env)
+            raise
+        env.update(compiled.as_dict(values))
+        return env
+    try:
+        if engine == 'ast':
+            program.eval(env)
+        elif engine == 'iterative':
+            iterative.execute(program, env)
+        elif engine == 'closures':
+            closures.compile_stmt(program)(env)
+        else:
+            raise ValueError('unknown engine: %s' % engine)
+    except BudgetExceeded as error:
+        error.env = env
+        raise
+    return env
+
+
+if __name__ == '__main__':
+    from lexer import imp_lex
+    from primitive import imp_parse
+    ast = imp_parse(imp_lex('x := 0; while 1 < 2 do x := x + 1 end')).value
+    for engine in ('ast', 'iterative', 'closures', 'slots', 'vm'):
+        try:
+            execute(ast, {}, Budget(steps=10000), engine)
+        except BudgetExceeded as error:
+            print '%-9s %s, env %r' % (engine, error, error.env)
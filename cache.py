@@ -0,0 +1,137 @@
+# encoding: utf-8
+
+import hashlib
+import os
+import tempfile
+from collections import OrderedDict
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from lexer import imp_lex
+from primitive import imp_parse
+
+"""
+    解析结果缓存：同一份源码不必每次都重新 lex 和 parse
+    key 是源码内容的 sha1，内存中是按最近使用顺序淘汰的 LRU，最多保存 capacity 份
+    可选的 directory 是磁盘上的存储，每份结果 pickle 为一个 <key>.pickle 文件，
+    进程重启之后 (warm restart) 内存缓存是空的，但仍然可以从磁盘读出结果，完全跳过 lex 和 parse
+
+    compiler 为 None 时缓存的是语法树；也可以传入 vm.compile_program 这类函数，缓存编译好的程序
+    (闭包无法 pickle，所以 closures.compile_stmt 只能配合纯内存缓存使用)
+    磁盘上的文件不区分 compiler，不同 compiler 的缓存要使用不同的 directory
+    解析失败 (imp_parse 返回 None) 的结果不缓存
+"""
+
+
+def source_key(text):
+    if not isinstance(text, bytes):
+        text = text.encode('utf-8')
+    return hashlib.sha1(text).hexdigest()
+
+
+class ParseCache:
+    """
+        hits / misses 是内存缓存的命中、未命中次数，disk_hits 是未命中内存但从磁盘读到的次数，
+        evictions 是因为超出 capacity 而淘汰的次数
+    """
+    def __init__(self, capacity=128, directory=None, compiler=None):
+        self.capacity = capacity
+        self.directory = directory
+        self.compiler = compiler
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def parse(self, text):
+        """
+            返回 text 的语法树 (或者 compiler 编译之后的结果)，解析失败时返回 None，有非法字符时抛出 lexer.LexError
+        """
+        key = source_key(text)
+        entries = self.entries
+        if key in entries:
+            value = entries.pop(key)
+            entries[key] = value
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = self.load(key)
+        if value is not None:
+            self.disk_hits += 1
+        else:
+            result = imp_parse(imp_lex(text))
+            if not result:
+                return None
+            value = result.value
+            if self.compiler is not None:
+                value = self.compiler(value)
+            self.store(key, value)
+        self.insert(key, value)
+        return value
+
+    def insert(self, key, value):
+        entries = self.entries
+        entries[key] = value
+        while len(entries) > self.capacity:
+            entries.popitem(last=False)
+            self.evictions += 1
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.pickle')
+
+    def load(self, key):
+        """
+            从磁盘读取，没有磁盘存储、文件不存在或者文件损坏时返回 None
+        """
+        if self.directory is None:
+            return None
+        try:
+            with open(self.path(key), 'rb') as file:
+                return pickle.load(file)
+        except Exception:
+            return None
+
+    def store(self, key, value):
+        """
+            先写临时文件再 rename，其它进程不会读到写了一半的文件
+        """
+        if self.directory is None:
+            return
+        fd, temp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                pickle.dump(value, file, pickle.HIGHEST_PROTOCOL)
+            os.rename(temp, self.path(key))
+        except Exception:
+            os.remove(temp)
+            raise
+
+    def clear(self):
+        """
+            只清空内存缓存，磁盘上的文件保留
+        """
+        self.entries.clear()
+
+    def reset(self):
+        self.clear()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.evictions = 0
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return float(self.hits) / total if total else 0.0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        return 'ParseCache(hits=%d, misses=%d, disk_hits=%d, evictions=%d, size=%d)' % \
+            (self.hits, self.misses, self.disk_hits, self.evictions, len(self.entries))
@@ -0,0 +1,319 @@
+# encoding: utf-8
+
+from ast import *
+from hoist import assigned, flatten
+
+"""
+    计数循环的闭式求值：形如 while i < n do s := s + k; i := i + 1 end 的循环不必一次一次地执行
+    accelerate(ast) 找出这样的 while，换成 CountingLoop (WhileStatement 的子类)，条件是：
+        循环体展开之后只有赋值语句，每个赋值的右边是循环中被赋值的变量 (状态变量) 的仿射函数：
+        乘法至少有一边与状态变量无关，除法的两边都与状态变量无关 (整数除法不是仿射的)；
+        条件是 RelopBexp，一边是某个状态变量 i (归纳变量)，另一边与状态变量无关 (循环中不变)
+    CountingLoop.eval 在执行时：
+        用当时的 env 把整个循环体化为一个仿射变换 v' = M v (v 是状态变量加上常数 1)，
+        归纳变量每次循环必须正好加上一个非 0 的常数 d，由 i、d 和边界算出循环次数 n，
+        然后直接算出 M^n v：M - I 是幂零矩阵时 (累加、多项式求和这类循环) 用二项式展开，与 n 无关；
+        否则 (x := 2 * x 这类) 用平方求幂，O(log n)
+    以下情况不能保证结果相同，都交给 WhileStatement.eval 一次一次地执行：
+        变量或者边界不是整数、循环中不变的除数为 0、归纳变量的增量不是非 0 常数、循环不会结束
+"""
+
+flipped = {'<': '>', '<=': '>=', '>': '<', '>=': '<=', '=': '=', '!=': '!='}
+
+
+def degree(node, degrees):
+    """
+        表达式对状态变量的次数：0 表示与状态变量无关，1 表示仿射，None 表示不是仿射的
+        degrees 是每个状态变量当前的次数 (循环体中前面的赋值可能已经把它变成常数或者非仿射的)
+    """
+    cls = node.__class__
+    if cls is IntAexp:
+        return 0
+    if cls is VarAexp:
+        return degrees.get(node.name, 0)
+    if cls is not BinopAexp:
+        return None
+    left = degree(node.left, degrees)
+    right = degree(node.right, degrees)
+    if left is None or right is None:
+        return None
+    if node.op in ('+', '-'):
+        return max(left, right)
+    if node.op == '*' and (left == 0 or right == 0):
+        return left + right
+    if node.op == '/' and left == right == 0:
+        return 0
+    return None
+
+
+def is_integer(value):
+    return isinstance(value, (int, long))
+
+
+def iterations(op, start, step, bound):
+    """
+        i 从 start 开始每次加 step，条件 i op bound 成立的次数；循环不会结束时返回 None
+    """
+    if op == '<=':
+        op, bound = '<', bound + 1
+    elif op == '>=':
+        op, bound = '>', bound - 1
+    if op == '<':
+        if start >= bound:
+            return 0
+        return (bound - start + step - 1) // step if step > 0 else None
+    if op == '>':
+        if start <= bound:
+            return 0
+        return (start - bound - step - 1) // -step if step < 0 else None
+    if op == '=':
+        return 1 if start == bound else 0
+    if start == bound:
+        return 0
+    distance = bound - start
+    if distance % step or distance // step < 0:
+        return None
+    return distance // step
+
+
+def apply_power(matrix, count, vector):
+    """
+        M^count * vector，M 的最后一行是 (0, ..., 0, 1)
+        先试二项式展开 M^n v = sum C(n, j) N^j v (N = M - I)：N^j v 在 size 步之内变成 0 时结果与 n 无关地算出
+    """
+    size = len(vector)
+    terms = [vector]
+    current = vector
+    for _ in xrange(size):
+        current = [sum(row[column] * current[column] for column in xrange(size)) - current[index]
+                   for index, row in enumerate(matrix)] + [0]
+        if not any(current):
+            result = [0] * size
+            binomial = 1
+            for power, term in enumerate(terms):
+                if power > count:
+                    break
+                for index in xrange(size):
+                    result[index] += binomial * term[index]
+                binomial = binomial * (count - power) // (power + 1)
+            return result
+        terms.append(current)
+    # 平方求幂
+    full = [list(row) for row in matrix] + [[0] * (size - 1) + [1]]
+    result = list(vector)
+    while count:
+        if count & 1:
+            result = [sum(row[column] * result[column] for column in xrange(size)) for row in full]
+        count >>= 1
+        if count:
+            full = [[sum(row[middle] * full[middle][column] for middle in xrange(size))
+                     for column in xrange(size)] for row in full]
+    return result
+
+
+class CountingLoop(WhileStatement):
+    """
+        counter 是归纳变量，op / bound 是条件中归纳变量一边的比较符和另一边的表达式 (归纳变量在左边)
+        names 是状态变量 (排好序)，assignments 是展开之后的循环体
+    """
+    __slots__ = ('counter', 'op', 'bound', 'names', 'assignments')
+
+    def __init__(self, condition, body, counter, op, bound, names, assignments):
+        WhileStatement.__init__(self, condition, body)
+        self.counter = counter
+        self.op = op
+        self.bound = bound
+        self.names = names
+        self.assignments = assignments
+
+    def __repr__(self):
+        return 'CountingLoop(%s, %s)' % (self.condition, self.body)
+
+    def eval(self, env):
+        if not self.jump(env):
+            WhileStatement.eval(self, env)
+
+    def linear(self, node, forms, env):
+        """
+            表达式化为状态变量初始值的仿射函数 [系数..., 常数]，不是仿射的时候返回 None
+        """
+        cls = node.__class__
+        if cls is IntAexp:
+            return [0] * len(self.names) + [node.i]
+        if cls is VarAexp:
+            form = forms.get(node.name)
+            if form is not None:
+                return form
+            value = env.get(node.name, 0)
+            return [0] * len(self.names) + [value] if is_integer(value) else None
+        left = self.linear(node.left, forms, env)
+        right = self.linear(node.right, forms, env)
+        if left is None or right is None:
+            return None
+        op = node.op
+        if op == '+':
+            return [a + b for a, b in zip(left, right)]
+        if op == '-':
+            return [a - b for a, b in zip(left, right)]
+        left_constant = not any(left[:-1])
+        right_constant = not any(right[:-1])
+        if op == '*' and right_constant:
+            return [a * right[-1] for a in left]
+        if op == '*' and left_constant:
+            return [left[-1] * b for b in right]
+        if op == '/' and left_constant and right_constant and right[-1] != 0:
+            return [0] * len(self.names) + [left[-1] / right[-1]]
+        return None
+
+    def jump(self, env):
+        """
+            直接算出循环结束之后的 env，不能保证结果相同时返回 False，env 不变
+        """
+        names = self.names
+        size = len(names)
+        values = [env.get(name, 0) for name in names]
+        if not all(is_integer(value) for value in values):
+            return False
+        try:
+            bound = self.bound.eval(env)
+        except ArithmeticError:
+            return False
+        if not is_integer(bound):
+            return False
+        forms = {}
+        for position, name in enumerate(names):
+            form = [0] * (size + 1)
+            form[position] = 1
+            forms[name] = form
+        for statement in self.assignments:
+            form = self.linear(statement.aexp, forms, env)
+            if form is None:
+                return False
+            forms[statement.name] = form
+        position = names.index(self.counter)
+        counter = forms[self.counter]
+        if counter[position] != 1 or any(counter[:position]) or any(counter[position + 1:-1]) or not counter[-1]:
+            return False
+        count = iterations(self.op, values[position], counter[-1], bound)
+        if count is None:
+            return False
+        if count:
+            final = apply_power([forms[name] for name in names], count, values + [1])
+            for position, name in enumerate(names):
+                env[name] = final[position]
+        return True
+
+
+def counting_loop(node):
+    """
+        符合条件的 while 返回 CountingLoop，否则返回 None
+    """
+    statements = flatten([node.body])
+    if not statements or not all(statement.__class__ is AssignStatement for statement in statements):
+        return None
+    condition = node.condition
+    if condition.__class__ is not RelopBexp:
+        return None
+    names = sorted(assigned(node.body))
+    degrees = dict((name, 1) for name in names)
+    for statement in statements:
+        degrees[statement.name] = degree(statement.aexp, degrees)
+        if degrees[statement.name] is None:
+            return None
+    for counter, op, bound in [(condition.left, condition.op, condition.right),
+                               (condition.right, flipped[condition.op], condition.left)]:
+        if counter.__class__ is VarAexp and counter.name in degrees and degree(bound, dict.fromkeys(names, 1)) == 0:
+            return CountingLoop(condition, node.body, counter.name, op, bound, names, statements)
+    return None
+
+
+class Accelerator:
+    """
+        把符合条件的 while 换成 CountingLoop，返回新的语法树，原来的语法树不会被修改
+    """
+    def __init__(self):
+        self.loops = 0
+        self.accelerated = 0
+
+    def rewrite(self, node):
+        cls = node.__class__
+        if cls is Block:
+            return Block([self.rewrite(statement) for statement in node.statements])
+        if cls is CompoundStatement:
+            return CompoundStatement(self.rewrite(node.first), self.rewrite(node.second))
+        if cls is IfStatement:
+            false_stmt = self.rewrite(node.false_stmt) if node.false_stmt else None
+            return IfStatement(node.condition, self.rewrite(node.true_stmt), false_stmt)
+        if cls is WhileStatement:
+            self.loops += 1
+            loop = counting_loop(node)
+            if loop is not None:
+                self.accelerated += 1
+                return loop
+            return WhileStatement(node.condition, self.rewrite(node.body))
+        return node
+
+
+def accelerate(stmt):
+    """
+        返回 (新的语法树, 统计)，统计中是 while 的个数和换成 CountingLoop 的个数
+    """
+    accelerator = Accelerator()
+    accelerated = accelerator.rewrite(stmt)
+    return accelerated, {'loops': accelerator.loops, 'accelerated': accelerator.accelerated}
+
+
+if __name__ == '__main__':
+    # 与 eval 对比：generator 生成的程序，以及随机生成的仿射循环 (各种比较符、步长、系数，一定会结束)
+    import random
+    from generator import generate
+    from lexer import imp_lex
+    from primitive import imp_parse
+    loops = accelerated = 0
+    for seed in range(300):
+        ast = imp_parse(imp_lex(generate(seed, statements=20, nesting=3, iterations=30))).value
+        expected = {}
+        ast.eval(expected)
+        fast, stats = accelerate(ast)
+        env = {}
+        fast.eval(env)
+        assert env == expected, seed
+        loops += stats['loops']
+        accelerated += stats['accelerated']
+    rand = random.Random(0)
+
+    def affine(names):
+        terms = ['(0 - %d)' % rand.randint(0, 5) if rand.random() < 0.5 else str(rand.randint(0, 5))]
+        for name in rand.sample(names, rand.randint(1, len(names))):
+            factor = rand.choice(['1', '2', '(0 - 1)', 'k', '(k / 3)'])
+            terms.append('%s * %s' % (name, factor) if rand.random() < 0.5 else '%s * %s' % (factor, name))
+        return ' + '.join(terms)
+
+    jumped = 0
+    for case in range(1000):
+        names = ['s%d' % index for index in range(rand.randint(1, 3))]
+        op = rand.choice(['<', '<=', '>', '>=', '!=', '='])
+        step = rand.choice([1, 2, 3, 7]) * (1 if op in ('<', '<=') else -1 if op in ('>', '>=') else rand.choice([1, -1]))
+        start = rand.randint(-20, 20)
+        bound = start + step * rand.randint(0, 12) if op == '!=' else start + rand.randint(-40, 40)
+        body = ['%s := %s' % (name, affine(names + ['i'])) for name in names]
+        body.insert(rand.randint(0, len(body)), 'i := i %s %d' % ('+' if step > 0 else '-', abs(step)))
+        condition = 'i %s n' % op if rand.random() < 0.5 else 'n %s i' % flipped[op]
+        text = 'while %s do %s end' % (condition, '; '.join(body))
+        ast = imp_parse(imp_lex(text)).value
+        initial = dict((name, rand.randint(-3, 3)) for name in names if rand.random() < 0.7)
+        initial.update({'i': start, 'n': bound, 'k': rand.randint(-3, 3)})
+        expected = dict(initial)
+        ast.eval(expected)
+        fast, stats = accelerate(ast)
+        assert stats['accelerated'] == 1, text
+        env = dict(initial)
+        jumped += fast.jump(env)
+        assert env == expected, (text, initial)
+    # 除数为 0 时交给 eval，循环一次都不执行时不能抛出异常
+    ast = accelerate(imp_parse(imp_lex('while i < n do x := x + 1 / d; i := i + 1 end')).value)[0]
+    env = {'n': 0, 'd': 0}
+    ast.eval(env)
+    assert env == {'n': 0, 'd': 0} and not ast.jump(dict(env))
+    print '300 generated programs: %d of %d loops accelerated' % (accelerated, loops)
+    print '1000 random affine loops match eval, %d computed in closed form' % jumped
@@ -0,0 +1,188 @@
+# encoding: utf-8
+
+import inspect
+import operator
+
+from ast import *
+
+"""
+    把语法树编译为一棵预先绑定好的闭包树
+    ast 中的 eval 每次执行都要遍历语法树：查 arith_binops / boolean_relops 字典、调用 lambda、
+    VarAexp 还要先 in env 再取一次值；这些工作在编译时做一次就够了
+    编译得到的函数 f 与 stmt.eval 用法相同：f(env) 直接修改 env
+    语义与 eval 保持一致：未赋值的变量读作 0，/ 就是 Python 的 /，and / or 两边都会求值
+"""
+
+arith_functions = {
+    '+': operator.add,
+    '-': operator.sub,
+    '*': operator.mul,
+    '/': operator.div,
+}
+
+relop_functions = {
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    '=': operator.eq,
+    '!=': operator.ne,
+}
+
+
+def unknown_operator(op):
+    """
+        与 eval 一样，未知操作符在执行到时才报错
+    """
+    def run(env):
+        raise RuntimeError('unknown operator: ' + op)
+    return run
+
+
+class ClosureCompiler:
+    """
+        对每种节点有一个 compile_<类名> 方法，返回以 env 为参数的闭包
+        变量的读写集中在 load / store 两个方法中，子类可以替换 env 的表示方式
+    """
+    def compile(self, node):
+        for cls in inspect.getmro(node.__class__):
+            method = getattr(self, 'compile_' + cls.__name__, None)
+            if method:
+                return method(node)
+        raise RuntimeError('cannot compile node: %r' % node)
+
+    def load(self, name):
+        def run(env):
+            return env.get(name, 0)
+        return run
+
+    def store(self, name, value):
+        def run(env):
+            env[name] = value(env)
+        return run
+
+    def compile_IntAexp(self, node):
+        i = node.i
+        return lambda env: i
+
+    def compile_VarAexp(self, node):
+        return self.load(node.name)
+
+    def compile_binop(self, functions, node):
+        if node.op not in functions:
+            return unknown_operator(node.op)
+        function = functions[node.op]
+        left = self.compile(node.left)
+        right = self.compile(node.right)
+        # 常数操作数直接绑定到闭包中，省去一次函数调用
+        if isinstance(node.right, IntAexp):
+            i = node.right.i
+            return lambda env: function(left(env), i)
+        if isinstance(node.left, IntAexp):
+            i = node.left.i
+            return lambda env: function(i, right(env))
+        return lambda env: function(left(env), right(env))
+
+    def compile_BinopAexp(self, node):
+        return self.compile_binop(arith_functions, node)
+
+    def compile_RelopBexp(self, node):
+        return self.compile_binop(relop_functions, node)
+
+    def compile_AndBexp(self, node):
+        left = self.compile(node.left)
+        right = self.compile(node.right)
+
+        def run(env):
+            left_value = left(env)
+            right_value = right(env)
+            return left_value and right_value
+        return run
+
+    def compile_OrBexp(self, node):
+        left = self.compile(node.left)
+        right = self.compile(node.right)
+
+        def run(env):
+            left_value = left(env)
+            right_value = right(env)
+            return left_value or right_value
+        return run
+
+    def compile_NotBexp(self, node):
+        exp = self.compile(node.exp)
+        return lambda env: not exp(env)
+
+    def compile_AssignStatement(self, node):
+        return self.store(node.name, self.compile(node.aexp))
+
+    def compile_CompoundStatement(self, node):
+        first = self.compile(node.first)
+        second = self.compile(node.second)
+
+        def run(env):
+            first(env)
+            second(env)
+        return run
+
+    def compile_Block(self, node):
+        statements = [self.compile(statement) for statement in node.statements]
+
+        def run(env):
+            for statement in statements:
+                statement(env)
+        return run
+
+    def compile_IfStatement(self, node):
+        condition = self.compile(node.condition)
+        true_stmt = self.compile(node.true_stmt)
+        if not node.false_stmt:
+            def run(env):
+                if condition(env):
+                    true_stmt(env)
+            return run
+        false_stmt = self.compile(node.false_stmt)
+
+        def run(env):
+            if condition(env):
+                true_stmt(env)
+            else:
+                false_stmt(env)
+        return run
+
+    def compile_WhileStatement(self, node):
+        condition = self.compile(node.condition)
+        body = self.compile(node.body)
+
+        def run(env):
+            while condition(env):
+                body(env)
+        return run
+
+    def compile_ChargeStatement(self, node):
+        # 展开 budget.charge，省去一次方法调用
+        budget = node.budget
+        steps = node.steps
+
+        def run(env):
+            budget.steps += steps
+            if budget.steps >= budget.next_check:
+                budget.check()
+        return run
+
+
+def compile_stmt(stmt):
+    """
+        把语句编译为闭包，用法：compile_stmt(ast)(env)
+    """
+    return ClosureCompiler().compile(stmt)
+
+
+if __name__ == '__main__':
+    from lexer import imp_lex
+    from primitive import imp_parse
+    text = 'n := 10; i := 0; s := 0; while i < n do s := s + i * 2; i := i + 1 end'
+    ast = imp_parse(imp_lex(text)).value
+    env = {}
+    compile_stmt(ast)(env)
+    print env
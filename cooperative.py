@@ -0,0 +1,153 @@
+# encoding: utf-8
+
+from collections import deque
+from timeit import default_timer as timer
+
+from iterative import steps
+
+"""
+    协作式执行：很多程序在同一个线程里轮流执行，长时间的循环不会一直占着线程，短程序不必排在长程序后面
+
+    evaluate(stmt, env, every) 是一个生成器，用 iterative.steps 执行语句，
+    每执行 every 步 (出栈一条语句算一步，while 每次检查条件也算一步) yield 一次，把控制权交回调用者
+    Scheduler 是一个最简单的轮转调度器 (相当于一个只跑 Imp 程序的事件循环)：
+        spawn 提交程序，返回 Task；同时执行的程序最多 limit 个，其余的排队等待 (并发限制)
+        step 让下一个程序执行一段 (every 步)，run 一直执行到所有程序都结束
+        task.cancel() 取消排队中或者执行中的程序
+    外部的事件循环 (比如 tornado 的 IOLoop.add_callback) 可以反复调用 step，每次最多占用 every 步的时间
+
+    Python 2 没有 asyncio，所以这里用生成器实现协作式调度，而不是 async / await 协程
+"""
+
+
+def evaluate(stmt, env, every=1000):
+    """
+        与 iterative.execute(stmt, env) 效果相同，每 every 步 yield 一次
+    """
+    countdown = every
+    for _ in steps(stmt, env):
+        countdown -= 1
+        if not countdown:
+            countdown = every
+            yield
+
+
+class Task(object):
+    """
+        一个提交给 Scheduler 的程序
+        state 为 pending (排队中)、running、done、failed (执行出错，错误在 error 中) 或 cancelled
+        created / started / finished 是提交、开始执行、结束的时间，latency 是从提交到结束的时间
+    """
+    def __init__(self, scheduler, stmt, env, name):
+        self.scheduler = scheduler
+        self.stmt = stmt
+        self.env = env
+        self.name = name
+        self.state = 'pending'
+        self.error = None
+        self.generator = None
+        self.created = timer()
+        self.started = None
+        self.finished = None
+
+    @property
+    def done(self):
+        return self.state in ('done', 'failed', 'cancelled')
+
+    @property
+    def latency(self):
+        return self.finished - self.created if self.finished is not None else None
+
+    def cancel(self):
+        self.scheduler.cancel(self)
+
+    def __repr__(self):
+        return 'Task(%r, %s)' % (self.name, self.state)
+
+
+class Scheduler(object):
+    """
+        every 是每个程序每次最多连续执行的步数，limit 是同时执行的程序个数上限，为 None 时不限制
+    """
+    def __init__(self, every=1000, limit=None):
+        self.every = every
+        self.limit = limit
+        self.pending = deque()
+        self.ready = deque()
+        self.running = 0
+
+    def spawn(self, stmt, env=None, name=None):
+        task = Task(self, stmt, {} if env is None else env, name)
+        if self.limit is None or self.running < self.limit:
+            self.start(task)
+        else:
+            self.pending.append(task)
+        return task
+
+    def start(self, task):
+        task.state = 'running'
+        task.started = timer()
+        task.generator = evaluate(task.stmt, task.env, self.every)
+        self.running += 1
+        self.ready.append(task)
+
+    def finish(self, task, state):
+        task.state = state
+        task.finished = timer()
+        task.generator = None
+        self.running -= 1
+        if self.pending and (self.limit is None or self.running < self.limit):
+            self.start(self.pending.popleft())
+
+    def cancel(self, task):
+        """
+            排队中的程序直接移出队列；执行中的程序关闭它的生成器，env 中保留已经执行出的部分结果
+        """
+        if task.state == 'pending':
+            self.pending.remove(task)
+            task.state = 'cancelled'
+            task.finished = timer()
+        elif task.state == 'running':
+            task.generator.close()
+            self.finish(task, 'cancelled')
+
+    def step(self):
+        """
+            让下一个执行中的程序执行一段，没有程序可以执行时返回 False
+        """
+        ready = self.ready
+        while ready:
+            task = ready.popleft()
+            if task.state != 'running':
+                # 已经取消了
+                continue
+            try:
+                next(task.generator)
+            except StopIteration:
+                self.finish(task, 'done')
+            except Exception as error:
+                task.error = error
+                self.finish(task, 'failed')
+            else:
+                ready.append(task)
+            return True
+        return False
+
+    def run(self):
+        while self.step():
+            pass
+
+
+if __name__ == '__main__':
+    from lexer import imp_lex
+    from primitive import imp_parse
+    long_program = imp_parse(imp_lex('i := 0; while i < 1000000 do i := i + 1 end')).value
+    short_program = imp_parse(imp_lex('x := 1; y := x * 2')).value
+    scheduler = Scheduler(every=1000, limit=100)
+    slow = scheduler.spawn(long_program, name='long')
+    quick = [scheduler.spawn(short_program, name=index) for index in range(5)]
+    while not all(task.done for task in quick):
+        scheduler.step()
+    slow.cancel()
+    scheduler.run()
+    print slow, slow.env, [task.env for task in quick]
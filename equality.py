@@ -1,10 +1,41 @@
 # encoding: utf-8
 
 
-class Equality:
+class Equality(object):
+    """
+        结构相等：类型相同并且 fields() 中的每个属性都相等
+        子类用 __slots__ 声明属性，没有 __dict__，fields() 按 MRO 收集全部 __slots__
+    """
+    __slots__ = ()
+    _fields = {}
+
+    @classmethod
+    def fields(cls):
+        fields = Equality._fields.get(cls)
+        if fields is None:
+            fields = []
+            for klass in reversed(cls.__mro__):
+                for name in klass.__dict__.get('__slots__', ()):
+                    if name not in fields:
+                        fields.append(name)
+            fields = Equality._fields[cls] = tuple(fields)
+        return fields
+
     def __eq__(self, other):
-        return isinstance(other, self.__class__) and \
-            self.__dict__ == other.__dict__
+        if not isinstance(other, self.__class__):
+            return False
+        for name in self.fields():
+            if getattr(self, name) != getattr(other, name):
+                return False
+        return True
 
     def __ne__(self, other):
         return not self.__eq__(other)
+
+    # 有 __slots__ 而没有 __dict__ 的对象，需要 __getstate__ / __setstate__ 才能用任意协议 pickle
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.fields())
+
+    def __setstate__(self, state):
+        for name, value in zip(self.fields(), state):
+            setattr(self, name, value)
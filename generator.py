@@ -0,0 +1,124 @@
+# encoding: utf-8
+
+import random
+
+"""
+    随机 Imp 程序生成器，同一个 seed 总是生成同一个程序
+    生成的程序一定能正常结束：
+    每个 while 循环都有自己专用的计数变量 (i0, i1, ...)，循环前置 0，循环体最后加 1，
+    循环体中的其它语句不会给计数变量赋值；除法的除数只用非 0 的常数
+    乘法的右边也只用常数，否则循环中反复 v := v * v 会让整数的位数成倍增长
+"""
+
+
+class ProgramGenerator:
+    """
+        statements: 顶层语句的条数
+        expr_depth: 表达式的最大嵌套深度
+        nesting:    if / while 的最大嵌套深度
+        iterations: 每个 while 循环的最大循环次数
+        variables:  普通变量的个数 (v0, v1, ...)
+        constants:  生成 '常数 op 常数'、'x * 1'、'x + 0' 这类可以化简的表达式的概率
+    """
+    def __init__(self, seed=0, statements=20, expr_depth=3, nesting=2,
+                 iterations=10, variables=5, constants=0.2):
+        self.random = random.Random(seed)
+        self.statements = statements
+        self.expr_depth = expr_depth
+        self.nesting = nesting
+        self.iterations = iterations
+        self.names = ['v%d' % index for index in range(variables)]
+        self.constants = constants
+        self.loops = 0
+
+    def program(self):
+        self.loops = 0
+        return self.stmt_list(self.statements, 0, 0)
+
+    def indent(self, level):
+        return '    ' * level
+
+    def stmt_list(self, count, nesting, level):
+        return ';\n'.join(self.stmt(nesting, level) for _ in range(count))
+
+    def stmt(self, nesting, level):
+        choice = self.random.random()
+        if nesting < self.nesting and choice < 0.15:
+            return self.while_stmt(nesting, level)
+        if nesting < self.nesting and choice < 0.3:
+            return self.if_stmt(nesting, level)
+        return self.assign_stmt(level)
+
+    def assign_stmt(self, level):
+        return '%s%s := %s' % (self.indent(level), self.random.choice(self.names),
+                               self.aexp(self.expr_depth))
+
+    def body(self, nesting, level):
+        count = self.random.randint(1, 3)
+        return self.stmt_list(count, nesting + 1, level + 1)
+
+    def if_stmt(self, nesting, level):
+        text = '%sif %s then\n%s' % (self.indent(level), self.bexp(2), self.body(nesting, level))
+        if self.random.random() < 0.5:
+            text += '\n%selse\n%s' % (self.indent(level), self.body(nesting, level))
+        return text + '\n%send' % self.indent(level)
+
+    def while_stmt(self, nesting, level):
+        counter = 'i%d' % self.loops
+        self.loops += 1
+        limit = self.random.randint(0, self.iterations)
+        if self.random.random() < self.constants:
+            # 条件恒为假的循环
+            condition = '%d < %d' % (limit + 1, limit)
+        else:
+            condition = '%s < %d' % (counter, limit)
+        return '%s%s := 0;\n%swhile %s do\n%s;\n%s%s := %s + 1\n%send' % (
+            self.indent(level), counter, self.indent(level), condition,
+            self.body(nesting, level), self.indent(level + 1), counter, counter,
+            self.indent(level))
+
+    def aexp(self, depth):
+        choice = self.random.random()
+        if depth > 0 and choice < self.constants:
+            return self.constant_aexp(depth)
+        if depth <= 0 or choice < 0.3:
+            return self.aexp_value()
+        op = self.random.choice(['+', '-', '*', '/'])
+        left = self.aexp(depth - 1)
+        if op in ('*', '/'):
+            right = str(self.random.randint(1, 9))
+        else:
+            right = self.aexp(depth - 1)
+        return '(%s %s %s)' % (left, op, right)
+
+    def constant_aexp(self, depth):
+        choice = self.random.random()
+        if choice < 0.5:
+            op = self.random.choice(['+', '-', '*', '/'])
+            return '(%d %s %d)' % (self.random.randint(0, 20), op, self.random.randint(1, 9))
+        if choice < 0.75:
+            return '(%s * 1)' % self.aexp(depth - 1)
+        return '(0 + %s)' % self.aexp(depth - 1)
+
+    def aexp_value(self):
+        if self.random.random() < 0.5:
+            return str(self.random.randint(0, 20))
+        return self.random.choice(self.names)
+
+    def bexp(self, depth):
+        choice = self.random.random()
+        if depth > 0 and choice < 0.15:
+            return 'not (%s)' % self.bexp(depth - 1)
+        if depth > 0 and choice < 0.35:
+            op = self.random.choice(['and', 'or'])
+            return '(%s) %s (%s)' % (self.bexp(depth - 1), op, self.bexp(depth - 1))
+        op = self.random.choice(['<', '<=', '>', '>=', '=', '!='])
+        return '%s %s %s' % (self.aexp(self.expr_depth - 1), op, self.aexp(self.expr_depth - 1))
+
+
+def generate(seed=0, **options):
+    return ProgramGenerator(seed, **options).program()
+
+
+if __name__ == '__main__':
+    print generate(0, statements=5)
@@ -0,0 +1,293 @@
+# encoding: utf-8
+
+from ast import *
+
+"""
+    循环不变量外提 (loop-invariant code motion) 和公共子表达式消除 (CSE)，与 optimizer 一样位于 imp_parse 和 eval 之间
+    def-use 分析：一个 while 中被赋值的变量 (AssignStatement 的 name，包括嵌套的 if / while 中的) 是循环中的定义，
+    循环体和条件中只读取 (VarAexp) 循环外的变量的 BinopAexp 是循环不变量，每一次循环的值都相同
+    1. 外提：循环不变量在循环之前算一次，存入临时变量，循环中改为读临时变量；相同的表达式共用一个临时变量
+       先处理外层循环再处理内层循环，所以每个表达式都提到它不变的最外层
+    2. CSE：一串连续的赋值语句 (Block / CompoundStatement 展开之后，遇到 if / while 为止) 中，
+       同一个 BinopAexp 出现多次、并且两次之间没有给它读取的变量赋值时，第一次出现之前算一次存入临时变量
+    临时变量名以 $ 开头 ($t0, $t1, ...)，lexer 不会产生这样的变量名，不会与程序中的变量冲突；visible(env) 去掉临时变量
+    优化不能改变执行结果，包括会不会抛出异常：
+    循环可能一次都不执行，所以只外提求值不会出错的表达式 (除法的除数必须是非 0 的常数)；
+    CSE 的临时变量在第一次出现的那条语句之前求值，这条语句本来就会对它求值 (算术表达式没有短路)，所以不受限制
+"""
+
+PREFIX = '$'
+
+
+def visible(env):
+    """
+        去掉临时变量之后的 env
+    """
+    return dict((name, value) for name, value in env.items() if not name.startswith(PREFIX))
+
+
+def expression_key(node, memo):
+    """
+        表达式的结构 (可以作为 dict 的键) 和它读取的变量
+        memo 以 id(node) 缓存子表达式的结果，只能在语法树仍然存在的期间使用 (否则 id 可能被新的节点重用)
+    """
+    result = memo.get(id(node))
+    if result is None:
+        cls = node.__class__
+        if cls is IntAexp:
+            result = (('int', node.i), frozenset())
+        elif cls is VarAexp:
+            result = (('var', node.name), frozenset([node.name]))
+        elif cls is BinopAexp:
+            left, left_reads = expression_key(node.left, memo)
+            right, right_reads = expression_key(node.right, memo)
+            result = ((node.op, left, right), left_reads | right_reads)
+        else:
+            raise TypeError('not an arithmetic expression: %s' % cls.__name__)
+        memo[id(node)] = result
+    return result
+
+
+def is_safe(node):
+    """
+        求值不会抛出异常：除法的除数都是非 0 的常数
+    """
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if node.__class__ is BinopAexp:
+            if node.op == '/' and not (node.right.__class__ is IntAexp and node.right.i != 0):
+                return False
+            stack.append(node.left)
+            stack.append(node.right)
+    return True
+
+
+def assigned(stmt):
+    """
+        语句中被赋值的全部变量
+    """
+    names = set()
+    stack = [stmt]
+    while stack:
+        node = stack.pop()
+        if node.__class__ is AssignStatement:
+            names.add(node.name)
+        elif isinstance(node, Statement):
+            stack.extend(children(node))
+    return names
+
+
+def flatten(statements):
+    """
+        展开嵌套的 Block / CompoundStatement
+    """
+    result = []
+    stack = list(reversed(statements))
+    while stack:
+        statement = stack.pop()
+        if statement.__class__ is CompoundStatement:
+            stack.append(statement.second)
+            stack.append(statement.first)
+        elif statement.__class__ is Block:
+            stack.extend(reversed(statement.statements))
+        else:
+            result.append(statement)
+    return result
+
+
+class Hoister:
+    """
+        对每种语句有一个 hoist_<类名> 方法，返回新的语句，原来的语法树不会被修改
+        hoisted 是外提的表达式个数，eliminated 是 CSE 省掉的求值次数 (每个语句中的出现算一次)
+    """
+    def __init__(self):
+        self.count = 0
+        self.hoisted = 0
+        self.eliminated = 0
+
+    def temporary(self):
+        name = '%st%d' % (PREFIX, self.count)
+        self.count += 1
+        return name
+
+    def hoist(self, stmt):
+        return getattr(self, 'hoist_' + stmt.__class__.__name__, lambda node: node)(stmt)
+
+    def hoist_Block(self, node):
+        return self.sequence(node.statements)
+
+    def hoist_CompoundStatement(self, node):
+        return self.sequence([node.first, node.second])
+
+    def hoist_IfStatement(self, node):
+        false_stmt = self.hoist(node.false_stmt) if node.false_stmt else None
+        return IfStatement(node.condition, self.hoist(node.true_stmt), false_stmt)
+
+    def hoist_WhileStatement(self, node):
+        defined = assigned(node.body)
+        memo = {}
+        temporaries = {}
+        hoisted = []
+
+        def replace(expression):
+            if expression.__class__ is not BinopAexp:
+                return expression
+            key, reads = expression_key(expression, memo)
+            if not (reads & defined) and is_safe(expression):
+                name = temporaries.get(key)
+                if name is None:
+                    name = temporaries[key] = self.temporary()
+                    hoisted.append(AssignStatement(name, expression))
+                return VarAexp(name)
+            return BinopAexp(expression.op, replace(expression.left), replace(expression.right))
+
+        condition = rewrite(node.condition, replace)
+        body = rewrite(node.body, replace)
+        self.hoisted += len(hoisted)
+        # 外提之后再处理循环体中的内层循环和连续的赋值语句
+        loop = WhileStatement(condition, self.hoist(body))
+        if not hoisted:
+            return loop
+        return Block(hoisted + [loop])
+
+    def sequence(self, statements):
+        """
+            处理一串语句：if / while 分别处理，其间连续的赋值语句做 CSE
+        """
+        result = []
+        run = []
+        for statement in flatten(statements):
+            if statement.__class__ is AssignStatement:
+                run.append(statement)
+                continue
+            # 外提到循环之前的赋值语句与前面的赋值语句一起做 CSE
+            for statement in flatten([self.hoist(statement)]):
+                if statement.__class__ is AssignStatement:
+                    run.append(statement)
+                else:
+                    result.extend(self.eliminate(run))
+                    run = []
+                    result.append(statement)
+        result.extend(self.eliminate(run))
+        if len(result) == 1:
+            return result[0]
+        return Block(result)
+
+    def eliminate(self, run):
+        """
+            连续赋值语句的 CSE，分两遍：
+            第一遍复制每条语句的表达式，已经算过并且仍然有效的表达式直接用第一次出现的那个节点 (复制品) 代替，
+            于是被多次用到的节点在新的语法树中出现多次，uses 记录再次用到的次数；
+            第二遍按同样的顺序遍历，被多次用到的节点第一次遇到时在语句之前赋给临时变量，之后都读临时变量
+        """
+        if not any(statement.aexp.__class__ is BinopAexp for statement in run):
+            return run
+        memo = {}
+        available = {}
+        uses = {}
+
+        def scan(node):
+            if node.__class__ is not BinopAexp:
+                return node
+            key, reads = expression_key(node, memo)
+            if key in available:
+                first = available[key][0]
+                uses[id(first)] += 1
+                return first
+            copy = BinopAexp(node.op, scan(node.left), scan(node.right))
+            available[key] = (copy, reads)
+            uses[id(copy)] = 0
+            return copy
+
+        scanned = []
+        for statement in run:
+            scanned.append(AssignStatement(statement.name, scan(statement.aexp)))
+            for key in [key for key, (_, reads) in available.items() if statement.name in reads]:
+                del available[key]
+        if not any(uses.values()):
+            return run
+        self.eliminated += sum(uses.values())
+
+        names = {}
+        result = []
+
+        def emit(node):
+            if node.__class__ is not BinopAexp:
+                return node
+            if not uses[id(node)]:
+                return BinopAexp(node.op, emit(node.left), emit(node.right))
+            name = names.get(id(node))
+            if name is None:
+                value = BinopAexp(node.op, emit(node.left), emit(node.right))
+                name = names[id(node)] = self.temporary()
+                result.append(AssignStatement(name, value))
+            return VarAexp(name)
+
+        for statement in scanned:
+            result.append(AssignStatement(statement.name, emit(statement.aexp)))
+        return result
+
+
+def rewrite(node, replace):
+    """
+        把语句或者布尔表达式中的每个算术表达式 e 换成 replace(e)，返回新的节点
+    """
+    cls = node.__class__
+    if cls is AssignStatement:
+        return AssignStatement(node.name, replace(node.aexp))
+    if cls is Block:
+        return Block([rewrite(statement, replace) for statement in node.statements])
+    if cls is CompoundStatement:
+        return CompoundStatement(rewrite(node.first, replace), rewrite(node.second, replace))
+    if cls is IfStatement:
+        false_stmt = rewrite(node.false_stmt, replace) if node.false_stmt else None
+        return IfStatement(rewrite(node.condition, replace), rewrite(node.true_stmt, replace), false_stmt)
+    if cls is WhileStatement:
+        return WhileStatement(rewrite(node.condition, replace), rewrite(node.body, replace))
+    if cls is RelopBexp:
+        return RelopBexp(node.op, replace(node.left), replace(node.right))
+    if cls is AndBexp:
+        return AndBexp(rewrite(node.left, replace), rewrite(node.right, replace))
+    if cls is OrBexp:
+        return OrBexp(rewrite(node.left, replace), rewrite(node.right, replace))
+    if cls is NotBexp:
+        return NotBexp(rewrite(node.exp, replace))
+    return node
+
+
+def optimize(stmt):
+    """
+        返回 (优化后的语法树, 统计)，统计中是外提的表达式个数、CSE 省掉的求值次数和用到的临时变量个数
+    """
+    hoister = Hoister()
+    optimized = hoister.hoist(stmt)
+    stats = {'hoisted': hoister.hoisted, 'eliminated': hoister.eliminated, 'temporaries': hoister.count}
+    return optimized, stats
+
+
+if __name__ == '__main__':
+    # 在随机生成的程序上对比优化前后的执行结果 (去掉临时变量之后)
+    from generator import generate
+    from lexer import imp_lex
+    from primitive import imp_parse
+    import optimizer
+    totals = {'hoisted': 0, 'eliminated': 0, 'temporaries': 0}
+    for seed in range(300):
+        text = generate(seed, statements=20, expr_depth=4, nesting=3, variables=seed % 6 + 2)
+        ast = imp_parse(imp_lex(text)).value
+        expected = {}
+        ast.eval(expected)
+        for program in (ast, optimizer.optimize(ast)[0]):
+            optimized, stats = optimize(program)
+            env = {}
+            optimized.eval(env)
+            assert visible(env) == expected, seed
+        for name in totals:
+            totals[name] += stats[name]
+    # 循环一次都不执行时，不能因为外提的除法抛出异常
+    ast = imp_parse(imp_lex('while i < 0 do x := a / b; i := i + 1 end')).value
+    env = {}
+    optimize(ast)[0].eval(env)
+    assert visible(env) == {}
+    print '300 programs match eval: %(hoisted)d hoisted, %(eliminated)d eliminated, %(temporaries)d temporaries' % totals
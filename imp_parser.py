@@ -1,20 +1,42 @@
 # encoding: utf-8
 
 import sys
-from primitive import imp_parse
-from lexer import imp_lex
+from primitive import expectation, imp_parse
+from lexer import LexError, imp_lex
+from optimizer import optimize
 
 
-def run():
-    text = 's := 4 ; t := s - 5'
-    tokens = imp_lex(text)
-    print 'tokens: ', tokens
-    parse_result = imp_parse(tokens)
-    print 'result_stmt and pos: ', parse_result
-    if not parse_result:
-        sys.stderr.write('Parse error !\n')
+def run(text='s := 4 ; t := s - 5', optimized=False, cache=None):
+    """
+        cache 是 cache.ParseCache 时，先按源码查缓存，命中时 lex 和 parse 都跳过；
+        未命中时由 cache 去 lex + parse，只有解析失败、需要给出错误信息时才在这里再 lex 一次
+        imp_parse 是递归的，if / while 嵌套几十层以上的程序会超过递归深度限制 (RuntimeError)，
+        这样的程序用 iterative.parse 解析、iterative.execute 执行
+    """
+    tokens = None
+    try:
+        if cache is not None:
+            ast = cache.parse(text)
+            print 'cache: ', cache
+        else:
+            tokens = imp_lex(text)
+            print 'tokens: ', tokens
+            parse_result = imp_parse(tokens)
+            print 'result_stmt and pos: ', parse_result
+            ast = parse_result.value if parse_result else None
+        if ast is None:
+            # 用预测模式再解析一次，得到出错位置和期望的 token
+            if tokens is None:
+                tokens = imp_lex(text)
+            imp_parse(tokens, predict=True)
+            sys.stderr.write('Parse error: %s\n' % expectation.message(tokens))
+            sys.exit(1)
+    except LexError as error:
+        sys.stderr.write('Lex error: %s\n' % error)
         sys.exit(1)
-    ast = parse_result.value
+    if optimized:
+        ast, stats = optimize(ast)
+        print 'optimized: %d nodes -> %d nodes' % (stats['before'], stats['after'])
     env = {}
     ast.eval(env)
     print 'eval result: ', env
@@ -25,3 +47,14 @@ def run():
 
 if __name__ == '__main__':
     run()
+
+    # 缓存命中时不 lex：第二次 run 时 lexer 一被调用就出错
+    import cache
+    parse_cache = cache.ParseCache()
+    run(cache=parse_cache)
+
+    def no_lex(text):
+        raise AssertionError('cache hit must not lex')
+    imp_lex = cache.imp_lex = no_lex
+    run(cache=parse_cache)
+    assert parse_cache.hits == 1
@@ -0,0 +1,235 @@
+# encoding: utf-8
+
+from bisect import bisect_left
+
+from ast import Block
+from lexer import RESERVED, LexError, imp_scanner
+from primitive import parser, stmt
+
+"""
+    增量 lex 和 parse：编辑器每次按键只修改了一小段文本，不必把整个文件重新 lex 和 parse
+
+    lex：tokens 旁边保存每个 token 的起始位置 starts
+    lexer 的正则最多只向匹配结果之后多看一个字符，所以结束位置在编辑位置之前 (不含) 的 token 不受影响，
+    从最后一个这样的 token 的结束位置开始重新 lex；越过编辑区域之后，
+    一旦新 token 的起始位置 (减去长度变化) 正好是某个旧 token 的起始位置，之后的 token 就和原来完全一样，直接复用
+
+    parse：程序是用 ; 分隔的顶层语句，顶层的 ; 就是 if / while 与 end 的嵌套深度为 0 的 ;
+    (语句内部的 ; 都在 if / while 之中，深度至少为 1)，每条顶层语句可以单独解析
+    编辑之后，从受影响的第一条语句开始重新划分语句，越过修改过的 token 之后，
+    遇到一个原来也是顶层分隔符的 ; 时停下，其后的语句连同语法树都直接复用
+    每条语句都解析成功时，结果与 imp_parse 完全相同：一条语句时就是这条语句，否则是 Block
+
+    编辑过程中可能暂时出现非法字符 (比如先输入 := 的 :，再输入 =)，编辑照常生效：
+    lexer 跳过非法字符继续扫描，document.errors 是当前文本中的全部 LexError，有错误时 ast 为 None
+"""
+
+
+def separators(tokens, lo):
+    """
+        从 lo (嵌套深度为 0 的位置) 开始，逐个 yield 顶层 ; 的下标
+    """
+    depth = 0
+    for index in xrange(lo, len(tokens)):
+        text, tag = tokens[index]
+        if tag is not RESERVED:
+            continue
+        if text == ';':
+            if depth == 0:
+                yield index
+        elif text == 'if' or text == 'while':
+            depth += 1
+        elif text == 'end':
+            depth -= 1
+
+
+class Document:
+    """
+        一份可以增量编辑的源码
+        text / tokens / starts 是当前的文本、token 及其起始位置
+        bounds 是顶层 ; 的下标，statements 是每条顶层语句的语法树 (解析失败的是 None)
+        error_offsets 是非法字符在 text 中的位置 (lex 时跳过)，errors 是对应的 LexError
+        relexed / reparsed 是最近一次编辑重新 lex 的 token 数和重新解析的语句数
+    """
+    def __init__(self, text=''):
+        self.text = ''
+        self.tokens = []
+        self.starts = []
+        self.error_offsets = []
+        self.bounds = []
+        self.statements = [None]
+        self.relexed = 0
+        self.reparsed = 0
+        self.edit(0, 0, text)
+
+    @property
+    def errors(self):
+        return [LexError.at(self.text, offset) for offset in self.error_offsets]
+
+    @property
+    def ast(self):
+        """
+            与 imp_parse(imp_lex(text)).value 相同，有非法字符或者解析失败时为 None
+        """
+        if self.error_offsets:
+            return None
+        statements = self.statements
+        if None in statements:
+            return None
+        if len(statements) == 1:
+            return statements[0]
+        return Block(list(statements))
+
+    def edit(self, offset, deleted, inserted):
+        """
+            把 text[offset:offset + deleted] 替换为 inserted，返回新的语法树
+        """
+        if offset < 0 or deleted < 0 or offset + deleted > len(self.text):
+            raise ValueError('edit out of range: %d, %d' % (offset, deleted))
+        first, old_end, count = self.relex(offset, deleted, inserted)
+        self.reparse(first, old_end, count)
+        return self.ast
+
+    def relex(self, offset, deleted, inserted):
+        """
+            旧的 tokens[first:old_end] 被替换为 count 个新 token，返回 (first, old_end, count)
+        """
+        text = self.text[:offset] + inserted + self.text[offset + deleted:]
+        delta = len(inserted) - deleted
+        edit_end = offset + len(inserted)
+        tokens = self.tokens
+        starts = self.starts
+
+        first = bisect_left(starts, offset)
+        while first > 0 and starts[first - 1] + len(tokens[first - 1][0]) >= offset:
+            first -= 1
+        pos = starts[first - 1] + len(tokens[first - 1][0]) if first > 0 else 0
+
+        new_tokens = []
+        new_starts = []
+        new_errors = []
+        old_end = len(tokens)
+        for token, start in imp_scanner.scan(text, pos, new_errors):
+            if start >= edit_end:
+                old = bisect_left(starts, start - delta, first)
+                if old < len(starts) and starts[old] == start - delta:
+                    old_end = old
+                    break
+            new_tokens.append(token)
+            new_starts.append(start)
+
+        tail = starts[old_end:]
+        if delta:
+            tail = [start + delta for start in tail]
+        # pos 之前的非法字符不变，重新对齐的 token 之后的非法字符平移，其间的换成这次扫描出的
+        offsets = self.error_offsets
+        resync = starts[old_end] if old_end < len(starts) else len(self.text) + 1
+        self.error_offsets = [error_offset for error_offset in offsets if error_offset < pos] + \
+            [error.offset for error in new_errors] + \
+            [error_offset + delta for error_offset in offsets if error_offset >= resync]
+        self.text = text
+        self.tokens = tokens[:first] + new_tokens + tokens[old_end:]
+        self.starts = starts[:first] + new_starts + tail
+        self.relexed = len(new_tokens)
+        return first, old_end, len(new_tokens)
+
+    def reparse(self, first, old_end, count):
+        """
+            从包含 tokens[first] 的顶层语句开始重新划分和解析，直到与原来的顶层分隔符重新对齐
+        """
+        bounds = self.bounds
+        shift = count - (old_end - first)
+        changed_end = first + count
+        a = bisect_left(bounds, first)
+        lo = bounds[a - 1] + 1 if a > 0 else 0
+
+        new_bounds = []
+        tail_bounds = []
+        tail_statements = []
+        ends = None
+        for index in separators(self.tokens, lo):
+            new_bounds.append(index)
+            if index >= changed_end:
+                b = bisect_left(bounds, index - shift, a)
+                if b < len(bounds) and bounds[b] == index - shift:
+                    tail_bounds = [bound + shift for bound in bounds[b + 1:]]
+                    tail_statements = self.statements[b + 1:]
+                    ends = new_bounds
+                    break
+        if ends is None:
+            # 没有重新对齐，一直划分到了末尾，最后一条语句结束于 token 的末尾
+            ends = new_bounds + [len(self.tokens)]
+
+        statements = []
+        for hi in ends:
+            statements.append(parse_statement(self.tokens, lo, hi))
+            lo = hi + 1
+        self.bounds = bounds[:a] + new_bounds + tail_bounds
+        self.statements = self.statements[:a] + statements + tail_statements
+        self.reparsed = len(statements)
+
+
+def parse_statement(tokens, lo, hi):
+    """
+        把 tokens[lo:hi] 解析为一条语句，必须正好用完这些 token，失败时返回 None
+    """
+    parser()
+    result = stmt()(tokens, lo)
+    if result and result.pos == hi:
+        return result.value
+    return None
+
+
+if __name__ == '__main__':
+    # 随机编辑生成的程序，每次编辑之后与完整的 lex + parse 对比
+    import random
+    import re
+    from generator import generate
+    from lexer import imp_lex_located
+    from primitive import imp_parse
+    pieces = [' ', ';', ':= ', '1', 'x', ' + 2', 'if ', ' then ', ' end', 'while ', ' do ',
+              '<', '=', '#', '\n', 'and', 'i0 < 3', 'y := 4;', ':', '!', '@']
+    rand = random.Random(0)
+    edits = valid = relexed = reparsed = tokens = 0
+
+    def check(document, offset, deleted, inserted):
+        global edits, valid, relexed, reparsed, tokens
+        text = document.text
+        expected = text[:offset] + inserted + text[offset + deleted:]
+        ast = document.edit(offset, deleted, inserted)
+        assert document.text == expected
+        full_errors = []
+        full_tokens = imp_lex_located(expected, full_errors)[0]
+        assert document.tokens == full_tokens, (offset, deleted, inserted)
+        assert [error.offset for error in document.errors] == [error.offset for error in full_errors]
+        result = imp_parse(full_tokens) if not full_errors else None
+        assert ast == (result.value if result else None), (offset, deleted, inserted)
+        edits += 1
+        valid += ast is not None
+        relexed += document.relexed
+        reparsed += document.reparsed
+        tokens += len(full_tokens)
+
+    for seed in range(30):
+        document = Document(generate(seed, statements=30))
+        for step in range(40):
+            if step % 10 == 0 and document.ast is None:
+                # 整个替换为新的程序
+                check(document, 0, len(document.text), generate(seed + step, statements=30))
+            text = document.text
+            offset = rand.randint(0, len(text))
+            deleted = rand.randint(0, min(8, len(text) - offset))
+            inserted = ''.join(rand.choice(pieces) for _ in range(rand.randint(0, 2)))
+            check(document, offset, deleted, inserted)
+            if document.ast is None and rand.random() < 0.9:
+                # 大多数时候撤销让程序无法解析的编辑，让文档大部分时候都是能解析的程序
+                check(document, offset, len(inserted), text[offset:offset + deleted])
+            digit = rand.choice([match.start() for match in re.finditer(r'[0-9]', document.text)])
+            check(document, digit, 1, rand.choice('123456789'))
+    # 逐个字符输入，:= 和 != 的第一个字符暂时是非法字符
+    document = Document('x := 1; ')
+    for character in 'y := x; if y != 1 then z := 2 end':
+        check(document, len(document.text), 0, character)
+    assert document.ast is not None and not document.errors
+    print '%d edits (%d parsed): %.1f tokens relexed, %.1f statements reparsed per edit (%.0f tokens per document)' % \
+        (edits, valid, float(relexed) / edits, float(reparsed) / edits, float(tokens) / edits)
@@ -0,0 +1,115 @@
+# encoding: utf-8
+
+import sys
+import threading
+
+from ast import *
+from lexer import imp_lex
+from primitive import imp_parse
+
+"""
+    非递归的语句执行器
+    stmt.eval 对 Block / CompoundStatement / IfStatement / WhileStatement 都是递归调用，
+    语句嵌套很深 (或者手工构造的 CompoundStatement 链很长) 时会超过 Python 的递归深度限制
+    execute 用一个显式的栈保存待执行的语句，语句的长度和嵌套深度都不再受递归深度限制
+    表达式仍然用各自的 eval 求值
+
+    注意 imp_parse 本身是递归的：每一层 if / while 嵌套大约用 30 层 Python 调用，
+    默认的递归深度限制 (1000) 下，嵌套三十多层的程序就会在 parse 时抛出 RuntimeError
+    parse(text) 在一个栈更大的线程中、临时调高递归深度限制之后 lex + parse，嵌套几千层的程序也可以解析
+"""
+
+
+def parse(text, recursion_limit=200000, stack_size=512 * 1024 * 1024):
+    """
+        与 imp_parse(imp_lex(text)) 相同，但不受默认递归深度限制的影响
+        只调高递归深度限制而不加大栈，很深的递归会让解释器直接崩溃，所以在 stack_size 字节栈的线程中执行
+    """
+    outcome = {}
+
+    def target():
+        try:
+            outcome['result'] = imp_parse(imp_lex(text))
+        except Exception:
+            outcome['error'] = sys.exc_info()
+
+    old_limit = sys.getrecursionlimit()
+    old_size = threading.stack_size(stack_size)
+    sys.setrecursionlimit(max(old_limit, recursion_limit))
+    try:
+        thread = threading.Thread(target=target)
+        thread.start()
+        thread.join()
+    finally:
+        sys.setrecursionlimit(old_limit)
+        threading.stack_size(old_size)
+    if 'error' in outcome:
+        error_type, error, traceback = outcome['error']
+        raise error_type, error, traceback
+    return outcome['result']
+
+
+def execute(stmt, env):
+    """
+        与 stmt.eval(env) 效果相同
+    """
+    for _ in steps(stmt, env):
+        pass
+
+
+def steps(stmt, env):
+    """
+        执行 stmt 的生成器，每执行一步 (出栈一条语句，while 每次检查条件也是一步) yield 这条语句
+        execute 一次执行完，cooperative.evaluate 每执行若干步交回控制权
+        栈顶是下一条要执行的语句：
+        Block / CompoundStatement 把子语句逆序压栈；IfStatement 按条件压入一个分支；
+        WhileStatement 条件成立时先压入自己再压入循环体，循环体执行完后会再次检查条件
+        其它类型的语句交给它自己的 eval
+    """
+    stack = [stmt]
+    pop = stack.pop
+    push = stack.append
+    while stack:
+        node = pop()
+        cls = node.__class__
+        if cls is AssignStatement:
+            env[node.name] = node.aexp.eval(env)
+        elif cls is Block:
+            stack.extend(reversed(node.statements))
+        elif cls is WhileStatement:
+            if node.condition.eval(env):
+                push(node)
+                push(node.body)
+        elif cls is IfStatement:
+            if node.condition.eval(env):
+                push(node.true_stmt)
+            elif node.false_stmt:
+                push(node.false_stmt)
+        elif cls is CompoundStatement:
+            push(node.second)
+            push(node.first)
+        else:
+            node.eval(env)
+        yield node
+
+
+if __name__ == '__main__':
+    # 手工构造一条很长的 CompoundStatement 链，eval 会超过递归深度限制
+    stmt = AssignStatement('x', IntAexp(0))
+    for _ in range(100000):
+        stmt = CompoundStatement(stmt, AssignStatement('x', BinopAexp('+', VarAexp('x'), IntAexp(1))))
+    env = {}
+    execute(stmt, env)
+    print env
+
+    # 嵌套 300 层的 while 经过 lex + parse：imp_parse 直接解析会超过递归深度限制
+    depth = 300
+    text = 'x := 0; ' + 'while x < 1 do ' * depth + 'x := x + 1' + ' end' * depth
+    try:
+        imp_parse(imp_lex(text))
+    except RuntimeError as error:
+        print 'imp_parse: %s' % error
+    env = {}
+    execute(parse(text).value, env)
+    assert env == {'x': 1}
+    print 'iterative.parse + execute, %d nested loops: %s' % (depth, env)
@@ -1,7 +1,11 @@
 # encoding: utf-8
 
-import sys
+import mmap
 import re
+from array import array
+from bisect import bisect_right
+
+from parser import TokenArray, token_code
 
 RESERVED = 'RESERVED'  # 保留字
 INT = 'INT'  # 整数
@@ -38,6 +42,35 @@ token_exprs = [
 ]
 
 
+class LexError(ValueError):
+    """
+        遇到不能匹配任何 pattern 的字符，offset 是它在输入中的位置，line / column 是行号和列号，都从 1 开始
+    """
+    def __init__(self, character, offset, line, column):
+        ValueError.__init__(self, 'line %d, column %d: illegal character %r' % (line, column, character))
+        self.character = character
+        self.offset = offset
+        self.line = line
+        self.column = column
+
+    @classmethod
+    def at(cls, characters, offset):
+        # characters 也可能是 mmap，没有 count 方法
+        prefix = characters[:offset]
+        line = prefix.count('\n') + 1
+        column = offset - prefix.rfind('\n')
+        return cls(characters[offset], offset, line, column)
+
+
+def literal(pattern):
+    """
+        pattern 只匹配一个固定的字符串时返回这个字符串，否则返回 None
+    """
+    if re.search(r'[][.^$*+?{}|()]', re.sub(r'\\.', '', pattern)) or re.search(r'\\\w', pattern):
+        return None
+    return re.sub(r'\\(.)', r'\1', pattern)
+
+
 def lex(characters, token_exprs):
     """
         lex 的工作方式，不是 split 开各个符号，然后逐一来检查
@@ -45,7 +78,7 @@ def lex(characters, token_exprs):
         然后，从头开始，循环遍历所有的 pattern，来看当前开头部分的字符是否 match
         如果 match，把位置挪到 match 部分之后，继续进行全部 pattern 的遍历 match
         也就是说，空格等特殊字符也必须对应 pattern，不然到了空格时就无法 match 了
-        如果没有 match，报错退出
+        如果没有 match，抛出 LexError
     """
     pos = 0
     tokens = []
@@ -67,16 +100,240 @@ def lex(characters, token_exprs):
                 # match 到了，就退出 pattern 的遍历
                 break
         if not match:
-            sys.stderr.write('Illegal character: %sn' % characters[pos])
-            sys.exit(1)
+            raise LexError.at(characters, pos)
         # match 到了，就挪到匹配部分的下一个位置，继续循环
         else:
             pos = match.end(0)
     return tokens
 
 
+class Scanner:
+    """
+        lex 的问题在于每个位置都要把全部 pattern 试一遍 (还要 re.compile 查缓存)
+        Scanner 在构造时就把 token_exprs 合并成一个带命名分组的大正则：
+            (?P<T0>[ \n\t]+)|(?P<T1>#[^\n]*)|(?P<T2>:=)|...
+        正则的 | 同样是从左到右、先 match 先赢，与 lex 的遍历顺序完全一致
+        匹配成功后通过 lastgroup 找到是哪个 pattern，从而得到 tag
+        这样整个输入只需要从头到尾扫描一遍
+    """
+    def __init__(self, token_exprs):
+        self.reserved = {}
+        self.tags = {}
+        self.codes = {}  # 分组名 -> token 编号，供 lex_array 使用；匹配文本不固定的保留字 pattern 没有
+        patterns = {}  # 非保留字的 tag -> 它的 pattern 的 list
+        groups = []
+        for index, (pattern, tag) in enumerate(token_exprs):
+            name = 'T%d' % index
+            self.tags[name] = tag
+            groups.append('(?P<%s>%s)' % (name, pattern))
+            if tag is RESERVED:
+                text = literal(pattern)
+                if text is not None:
+                    self.codes[name] = token_code((intern(text), tag))
+            elif tag:
+                self.codes[name] = token_code(tag)
+                patterns.setdefault(tag, []).append(pattern)
+        self.regex = re.compile('|'.join(groups))
+        # TokenArray 取出文本时只用这种 token 自己的正则重新匹配，保留字的文本是固定的，不会用到
+        self.matchers = dict((token_code(tag), re.compile('|'.join(tag_patterns)).match)
+                             for tag, tag_patterns in patterns.items())
+
+    def lex(self, characters):
+        pos = 0
+        end = len(characters)
+        tokens = []
+        match_at = self.regex.match
+        tags = self.tags
+        shared = {}
+        while pos < end:
+            match = match_at(characters, pos)
+            if not match:
+                raise LexError.at(characters, pos)
+            tag = tags[match.lastgroup]
+            if tag:
+                text = match.group()
+                token = shared.get(text)
+                if token is None:
+                    token = shared[text] = self.token(text, tag)
+                tokens.append(token)
+            pos = match.end()
+        return tokens
+
+    def token(self, text, tag):
+        """
+            保留字的 token 在所有调用之间共享同一个 tuple，文本也 intern，
+            操作符和关键字在 token 以及语法树中都是同一个字符串对象
+            lex 还会在一次调用之内共享文本相同的 token，同一个变量名或数字只保存一份
+            (没有前瞻的正则，同样的文本总是由同一个 pattern 匹配出来，所以按文本共享不会混淆 tag)
+        """
+        if tag is not RESERVED:
+            return (text, tag)
+        token = self.reserved.get(text)
+        if token is None:
+            if isinstance(text, str):
+                text = intern(text)
+            token = self.reserved[text] = (text, tag)
+        return token
+
+    def lex_array(self, source):
+        """
+            lex 的紧凑版本，返回 parser.TokenArray，source 可以是 str 或者 mmap
+            每个 token 只记录起始位置和 token 编号，不切出文本也不建 tuple
+        """
+        starts = array('i' if len(source) < 2 ** 31 else 'l')
+        codes = array('H')
+        add_start = starts.append
+        add_code = codes.append
+        match_at = self.regex.match
+        tags = self.tags
+        group_codes = self.codes
+        pos = 0
+        end = len(source)
+        while pos < end:
+            match = match_at(source, pos)
+            if not match:
+                raise LexError.at(source, pos)
+            name = match.lastgroup
+            if tags[name]:
+                code = group_codes.get(name)
+                if code is None:
+                    code = token_code((intern(match.group()), RESERVED))
+                add_start(pos)
+                add_code(code)
+            pos = match.end()
+        return TokenArray(source, starts, codes, self.matchers)
+
+    def scan(self, characters, pos=0, errors=None):
+        """
+            从 pos 开始逐个 yield (token, token 的起始位置)，供增量 lex 使用
+            pos 必须是某个 token、空白或注释的起始位置
+            遇到非法字符时抛出 LexError；给出 errors (list) 时改为把 LexError 加入 errors，跳过这个字符继续扫描
+        """
+        end = len(characters)
+        match_at = self.regex.match
+        tags = self.tags
+        while pos < end:
+            match = match_at(characters, pos)
+            if not match:
+                if errors is None:
+                    raise LexError.at(characters, pos)
+                errors.append(LexError.at(characters, pos))
+                pos += 1
+                continue
+            tag = tags[match.lastgroup]
+            if tag:
+                yield self.token(match.group(), tag), pos
+            pos = match.end()
+
+    def locate(self, characters, errors=None):
+        """
+            返回 (tokens, positions)，positions[i] 是 tokens[i] 的 (行号, 列号)，都从 1 开始
+            tokens 与 lex 的结果相同；errors 的含义同 scan
+        """
+        line_starts = [0]
+        index = characters.find('\n')
+        while index >= 0:
+            line_starts.append(index + 1)
+            index = characters.find('\n', index + 1)
+        tokens = []
+        positions = []
+        for token, start in self.scan(characters, 0, errors):
+            line = bisect_right(line_starts, start)
+            tokens.append(token)
+            positions.append((line, start - line_starts[line - 1] + 1))
+        return tokens, positions
+
+    def stream(self, chunks):
+        """
+            流式版本：chunks 是字符块的可迭代对象，逐个 yield token
+            缓冲区里只保留还没消费完的字符，内存占用和输入总长度无关
+            难点在于 token 和注释可能跨越两个块，比如 '<' 在本块末尾而 '=' 在下一块开头，
+            所以只要匹配一直延伸到缓冲区末尾 (或者根本匹配不上)，就先读入下一块再重新匹配
+        """
+        match_at = self.regex.match
+        tags = self.tags
+        chunks = iter(chunks)
+        buffer = ''
+        pos = 0
+        more = True
+        # 已经丢弃的字符数、其中的换行数和最后一个换行的位置，用来算出错位置的行号和列号
+        dropped = lines = 0
+        last_newline = -1
+        while True:
+            end = len(buffer)
+            if pos < end:
+                match = match_at(buffer, pos)
+                if match and (match.end() < end or not more):
+                    tag = tags[match.lastgroup]
+                    if tag:
+                        yield self.token(match.group(), tag)
+                    pos = match.end()
+                    continue
+                if not more:
+                    error = LexError.at(buffer, pos)
+                    if error.line == 1:
+                        error = LexError(error.character, dropped + pos, lines + 1,
+                                         dropped + pos - last_newline)
+                    else:
+                        error = LexError(error.character, dropped + pos, lines + error.line, error.column)
+                    raise error
+            elif not more:
+                return
+            # 读入下一块，同时丢掉已经消费的部分
+            chunk = next(chunks, None)
+            if chunk is None:
+                more = False
+            else:
+                newlines = buffer.count('\n', 0, pos)
+                if newlines:
+                    lines += newlines
+                    last_newline = dropped + buffer.rfind('\n', 0, pos)
+                dropped += pos
+                buffer = buffer[pos:] + chunk
+                pos = 0
+
+
+imp_scanner = Scanner(token_exprs)
+
+
 def imp_lex(characters):
-    return lex(characters, token_exprs)
+    return imp_scanner.lex(characters)
+
+
+def imp_lex_array(source):
+    """
+        返回 parser.TokenArray，可以直接交给 imp_parse，token 不占用额外的字符串和 tuple
+    """
+    return imp_scanner.lex_array(source)
+
+
+def imp_lex_file(path):
+    """
+        把文件 mmap 到内存中 lex，返回的 TokenArray 直接引用映射的内容，不把整个文件读成字符串
+    """
+    with open(path, 'rb') as file:
+        if not file.read(1):
+            return imp_lex_array('')
+        return imp_lex_array(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def imp_lex_located(characters, errors=None):
+    """
+        imp_lex 的带位置版本，返回 (tokens, positions)，positions[i] 是 tokens[i] 的 (行号, 列号)
+        给出 errors (list) 时不抛出 LexError，而是收集到 errors 中并跳过非法字符
+    """
+    return imp_scanner.locate(characters, errors)
+
+
+def imp_lex_stream(source, chunk_size=65536):
+    """
+        source 可以是文件对象 (按 chunk_size 分块读取)，也可以是字符块的可迭代对象
+        返回 token 的生成器，配合 parser.TokenWindow 可以直接交给 imp_parse
+    """
+    if hasattr(source, 'read'):
+        read = source.read
+        source = iter(lambda: read(chunk_size), '')
+    return imp_scanner.stream(source)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,188 @@
+# encoding: utf-8
+
+import inspect
+
+from ast import *
+
+"""
+    语法树优化，位于 imp_parse 和 eval 之间：
+    1. 常数折叠：IntAexp op IntAexp 直接算出结果；所有操作数都是常数的布尔表达式也直接求值
+    2. 代数化简：x * 1、1 * x、x + 0、0 + x、x - 0、x / 1 都化简为 x；
+       布尔值只可能是 True / False，所以 e and True、True and e、e or False、False or e 化简为 e
+    3. 死代码删除：条件为常数的 if 只保留会执行的分支；条件恒为假的 while 整个删除
+    化简不能改变执行结果，包括会不会抛出异常：
+    除数为 0 的常数除法不折叠，e and False 这类还需要对 e 求值的表达式也不化简
+"""
+
+
+def count_nodes(node):
+    count = 0
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        count += 1
+        stack.extend(children(node))
+    return count
+
+
+def is_constant(node):
+    """
+        不含变量的表达式就是常数
+    """
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, VarAexp):
+            return False
+        stack.extend(children(node))
+    return True
+
+
+def constant_value(node):
+    """
+        常数表达式的值；求值会出错 (比如除数为 0) 时返回 None，表示不能折叠
+    """
+    if not is_constant(node):
+        return None
+    try:
+        return node.eval({})
+    except (ArithmeticError, RuntimeError):
+        return None
+
+
+class Optimizer:
+    """
+        对每种节点有一个 fold_<类名> 方法，返回化简后的新节点，原来的语法树不会被修改
+    """
+    def fold(self, node):
+        for cls in inspect.getmro(node.__class__):
+            method = getattr(self, 'fold_' + cls.__name__, None)
+            if method:
+                return method(node)
+        return node
+
+    def fold_BinopAexp(self, node):
+        left = self.fold(node.left)
+        right = self.fold(node.right)
+        op = node.op
+        node = BinopAexp(op, left, right)
+        if isinstance(left, IntAexp) and isinstance(right, IntAexp):
+            value = constant_value(node)
+            if value is not None:
+                return IntAexp(value)
+        if isinstance(right, IntAexp):
+            if (op in ('+', '-') and right.i == 0) or (op in ('*', '/') and right.i == 1):
+                return left
+        if isinstance(left, IntAexp):
+            if (op == '+' and left.i == 0) or (op == '*' and left.i == 1):
+                return right
+        return node
+
+    def fold_RelopBexp(self, node):
+        return RelopBexp(node.op, self.fold(node.left), self.fold(node.right))
+
+    def fold_AndBexp(self, node):
+        left = self.fold(node.left)
+        right = self.fold(node.right)
+        if constant_value(right) is True:
+            return left
+        if constant_value(left) is True:
+            return right
+        return AndBexp(left, right)
+
+    def fold_OrBexp(self, node):
+        left = self.fold(node.left)
+        right = self.fold(node.right)
+        if constant_value(right) is False:
+            return left
+        if constant_value(left) is False:
+            return right
+        return OrBexp(left, right)
+
+    def fold_NotBexp(self, node):
+        return NotBexp(self.fold(node.exp))
+
+    def fold_AssignStatement(self, node):
+        return AssignStatement(node.name, self.fold(node.aexp))
+
+    def fold_sequence(self, statements):
+        """
+            折叠一串语句，展开嵌套的 Block / CompoundStatement，去掉空的 Block
+            结果只剩一条语句时直接返回这条语句
+        """
+        result = []
+        stack = list(reversed(statements))
+        while stack:
+            statement = stack.pop()
+            if isinstance(statement, CompoundStatement):
+                stack.append(statement.second)
+                stack.append(statement.first)
+                continue
+            statement = self.fold(statement)
+            if isinstance(statement, Block):
+                result.extend(statement.statements)
+            else:
+                result.append(statement)
+        if len(result) == 1:
+            return result[0]
+        return Block(result)
+
+    def fold_Block(self, node):
+        return self.fold_sequence(node.statements)
+
+    def fold_CompoundStatement(self, node):
+        return self.fold_sequence([node.first, node.second])
+
+    def fold_IfStatement(self, node):
+        condition = self.fold(node.condition)
+        value = constant_value(condition)
+        if value is not None:
+            if value:
+                return self.fold(node.true_stmt)
+            if node.false_stmt:
+                return self.fold(node.false_stmt)
+            return Block([])
+        true_stmt = self.fold(node.true_stmt)
+        false_stmt = self.fold(node.false_stmt) if node.false_stmt else None
+        if is_empty(false_stmt):
+            false_stmt = None
+        return IfStatement(condition, true_stmt, false_stmt)
+
+    def fold_WhileStatement(self, node):
+        condition = self.fold(node.condition)
+        value = constant_value(condition)
+        if value is not None and not value:
+            return Block([])
+        return WhileStatement(condition, self.fold(node.body))
+
+
+def is_empty(stmt):
+    return isinstance(stmt, Block) and not stmt.statements
+
+
+def optimize(stmt):
+    """
+        返回 (优化后的语法树, 统计)，统计中是优化前后的节点个数
+    """
+    optimized = Optimizer().fold(stmt)
+    stats = {'before': count_nodes(stmt), 'after': count_nodes(optimized)}
+    return optimized, stats
+
+
+if __name__ == '__main__':
+    # 在随机生成的程序上对比优化前后的执行结果
+    from generator import generate
+    from lexer import imp_lex
+    from primitive import imp_parse
+    before = after = 0
+    for seed in range(200):
+        ast = imp_parse(imp_lex(generate(seed))).value
+        optimized, stats = optimize(ast)
+        expected = {}
+        ast.eval(expected)
+        env = {}
+        optimized.eval(env)
+        assert env == expected, seed
+        before += stats['before']
+        after += stats['after']
+    print '200 programs: %d nodes -> %d nodes' % (before, after)
@@ -1,7 +1,12 @@
 # encoding: utf-8
 
+from copy import copy
+from timeit import default_timer as timer
+
+
+class Result(object):
+    __slots__ = ('value', 'pos')
 
-class Result:
     def __init__(self, value, pos):
         self.value = value
         self.pos = pos
@@ -10,6 +15,119 @@ class Result:
         return 'Result(%s, %d)' % (self.value, self.pos)
 
 
+class TokenWindowError(RuntimeError):
+    pass
+
+
+class TokenWindow:
+    """
+        把 token 生成器包装成 parser 能用的 tokens：支持 tokens[pos] 和 len(tokens)
+        token 按需从生成器读取，只在缓冲区中保留最近访问位置之前的 size 个 token，
+        更早的 token 会被丢弃，这样解析巨大的脚本时不需要同时持有全部 token
+        回溯超出窗口时抛出 TokenWindowError，这时应该调大 size
+    """
+    def __init__(self, tokens, size=4096):
+        self.tokens = iter(tokens)
+        self.size = size
+        self.buffer = []
+        self.offset = 0     # buffer[0] 在整个 token 流中的位置
+        self.highest = -1   # 访问过的最大位置
+        self.done = False
+
+    def fill(self, pos):
+        buffer = self.buffer
+        while not self.done and self.offset + len(buffer) <= pos:
+            token = next(self.tokens, None)
+            if token is None:
+                self.done = True
+            else:
+                buffer.append(token)
+
+    def __getitem__(self, pos):
+        if pos < self.offset:
+            raise TokenWindowError('token %d is out of the window' % pos)
+        self.fill(pos)
+        index = pos - self.offset
+        if index >= len(self.buffer):
+            raise IndexError(pos)
+        if pos > self.highest:
+            self.highest = pos
+            # 缓冲区超过两倍窗口时，丢弃窗口之前的 token
+            drop = pos - self.offset - self.size
+            if drop > self.size:
+                del self.buffer[:drop]
+                self.offset += drop
+                index -= drop
+        return self.buffer[index]
+
+    def __len__(self):
+        """
+            parser 中的位置最多比访问过的最大位置大 1，
+            所以只要多读一个 token，就能正确回答 pos < len(tokens) 和 pos == len(tokens)
+        """
+        self.fill(self.highest + 1)
+        return self.offset + len(self.buffer)
+
+
+"""
+    token 编号：每一种保留字 token (文本, tag) 和每一种其它 tag 都有一个固定的小整数编号，
+    TokenArray 中每个 token 只保存这个编号，Reserved / Tag 直接比较编号，不必取出 token 的文本
+    token_keys[编号] 是保留字的 (文本, tag) 或者 tag 本身，token_tags[编号] 是它的 tag
+"""
+token_codes = {}
+token_keys = []
+token_tags = []
+
+
+def token_code(key):
+    code = token_codes.get(key)
+    if code is None:
+        code = token_codes[key] = len(token_keys)
+        token_keys.append(key)
+        token_tags.append(key[1] if isinstance(key, tuple) else key)
+    return code
+
+
+class TokenArray(object):
+    """
+        紧凑的 token 流：starts 是每个 token 在 source 中的起始位置，codes 是 token 编号，都是 array，每个 token 6 字节
+        source 可以是 str 或者 mmap，token 不再各自是一个 tuple 和一个字符串，
+        Reserved 和 Tag 直接比较 codes，只有 Tag 匹配成功时才取出 token 的文本：
+        matchers 是 token 编号 -> 这种 token 的正则的 match，从起始位置重新匹配一次得到文本，这样不必再保存结束位置
+        tokens[pos] 仍然返回 (文本, tag)，其它按 tuple 读 token 的代码不用修改
+    """
+    __slots__ = ('source', 'starts', 'codes', 'matchers')
+
+    def __init__(self, source, starts, codes, matchers):
+        self.source = source
+        self.starts = starts
+        self.codes = codes
+        self.matchers = matchers
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, pos):
+        key = token_keys[self.codes[pos]]
+        if isinstance(key, tuple):
+            return key
+        return self.text(pos), key
+
+    def text(self, pos):
+        code = self.codes[pos]
+        matcher = self.matchers.get(code)
+        if matcher is None:
+            # 保留字
+            return token_keys[code][0]
+        return matcher(self.source, self.starts[pos]).group()
+
+    def nbytes(self):
+        """
+            两个 array 中数据的字节数 (不含 source)
+        """
+        return len(self.starts) * self.starts.itemsize + len(self.codes) * self.codes.itemsize
+
+
 class Parser:
     def __call__(self, tokens, pos):
         pass  # subclass will override it
@@ -40,8 +158,13 @@ class Reserved(Parser):
     def __init__(self, value, tag):
         self.value = value
         self.tag = tag
+        self.code = token_code((value, tag))
 
     def __call__(self, tokens, pos):
+        if tokens.__class__ is TokenArray:
+            if pos < len(tokens.codes) and tokens.codes[pos] == self.code:
+                return Result(self.value, pos + 1)
+            return None
         if pos < len(tokens) and tokens[pos][0] == self.value and \
                 tokens[pos][1] is self.tag:
             return Result(tokens[pos][0], pos + 1)
@@ -60,6 +183,10 @@ class Tag(Parser):
         self.tag = tag
 
     def __call__(self, tokens, pos):
+        if tokens.__class__ is TokenArray:
+            if pos < len(tokens.codes) and token_tags[tokens.codes[pos]] is self.tag:
+                return Result(tokens.text(pos), pos + 1)
+            return None
         if pos < len(tokens) and tokens[pos][1] is self.tag:
             return Result(tokens[pos][0], pos + 1)
         else:
@@ -194,6 +321,99 @@ class Phrase(Parser):
             return None
 
 
+class MemoTable:
+    """
+        packrat 解析用的备忘表，记录 (规则, pos) -> Result
+        同一个规则在同一个位置的解析结果总是相同的，查表就不必重新解析
+        hits / misses 是累计的命中、未命中次数，size 是最近一次 clear 前表的大小
+    """
+    def __init__(self):
+        self.table = {}
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+
+    def clear(self):
+        self.size = len(self.table)
+        self.table = {}
+
+    def reset(self):
+        self.clear()
+        self.hits = 0
+        self.misses = 0
+        self.size = 0
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return float(self.hits) / total if total else 0.0
+
+    def __repr__(self):
+        return 'MemoTable(hits=%d, misses=%d, size=%d, hit_rate=%.2f)' % \
+            (self.hits, self.misses, self.size, self.hit_rate())
+
+
+class Memo(Parser):
+    """
+        packrat 解析器：先查备忘表，查不到才真正调用 parser 并记录结果 (失败的 None 也记录)
+        key 默认为本对象的 id，也可以传入规则名，让同一规则的不同实例共享记录
+        注意 Process 会直接修改 result.value，所以返回的是记录的一个拷贝
+    """
+    def __init__(self, parser, table, key=None):
+        self.parser = parser
+        self.table = table
+        self.key = key if key is not None else id(self)
+
+    def __call__(self, tokens, pos):
+        table = self.table
+        key = (self.key, pos)
+        if key in table.table:
+            table.hits += 1
+            result = table.table[key]
+        else:
+            table.misses += 1
+            result = self.parser(tokens, pos)
+            table.table[key] = result
+        if result:
+            return Result(result.value, result.pos)
+        return result
+
+
+class LocationTable:
+    """
+        记录解析结果从哪个 token 开始，按结果对象的 id 索引
+        同时保存结果对象本身，解析过程中回溯丢弃的结果不会被回收，id 也就不会被新对象重用
+    """
+    def __init__(self):
+        self.table = {}
+
+    def record(self, value, pos):
+        # 同一个结果经过多层规则时只记录最内层的 (起始位置是一样的)
+        if id(value) not in self.table:
+            self.table[id(value)] = (value, pos)
+
+    def position(self, value):
+        entry = self.table.get(id(value))
+        return entry[1] if entry is not None and entry[0] is value else None
+
+    def clear(self):
+        self.table = {}
+
+
+class Locate(Parser):
+    """
+        把 parser 解析出的结果及其起始位置记录到 LocationTable 中
+    """
+    def __init__(self, parser, table):
+        self.parser = parser
+        self.table = table
+
+    def __call__(self, tokens, pos):
+        result = self.parser(tokens, pos)
+        if result:
+            self.table.record(result.value, pos)
+        return result
+
+
 class Exp(Parser):
     """
         参数为两个解析器，一个用来解析列表元素，一个用来解析分隔符
@@ -207,26 +427,497 @@ class Exp(Parser):
         # 先用本 parser 对最左边的一段解析
         result = self.parser(tokens, pos)
 
-        def process_next(parsed):
-            # sepfunc 是 self.separator 解析的结果； right 是 self.parser 解析的结果
-            (sepfunc, right) = parsed
-            # 然后使用 sepfunc 把左边和右边的结果结合，故此 separator 不能是个简单的字符串，而应该是个解析器
-            return sepfunc(result.value, right)
-
-        # 剩下的部分，使用 separator + parser 解析，举个例子
-        # 'a ; b ; c'  -->  最开始解析了 'a'  --> 然后到这里，解析 '; + b'
-        # 那么 '; + b' 得到的 value 应该是 (;, b), pos 应该走到第二个 ';' 那里
-        # 然后，利用 ^ 对 (;, b) 进行 process_next 调用
-        next_parser = self.separator + self.parser ^ process_next   # 先 + 再 ^
-        next_result = result
-
-        while next_result:
-            next_result = next_parser(tokens, result.pos)
-            if next_result:
-                result = next_result
+        # 剩下的部分，依次解析 separator 和 parser，举个例子
+        # 'a ; b ; c'  -->  最开始解析了 'a'  --> 然后到这里，解析 '; b'
+        # separator 的结果 sepfunc 用来把左边和右边的结果结合，故此 separator 不能是个简单的字符串，而应该是个解析器
+        # 效果等同于用 (separator + parser) ^ 结合函数 循环解析，但不必每次调用都新建组合子
+        while result:
+            sep_result = self.separator(tokens, result.pos)
+            if not sep_result:
+                break
+            right_result = self.parser(tokens, sep_result.pos)
+            if not right_result:
+                break
+            result = Result(sep_result.value(result.value, right_result.value), right_result.pos)
+        return result
+
+
+class Precedence(Parser):
+    """
+        二元运算表达式的算符优先 (precedence climbing / Pratt) 解析器，所有运算符都是左结合
+        precedence_levels 与 Exp 叠成的塔一样，是优先级由高到低的操作符列表的列表，
+        combine(op) 返回把左右两个结果合并起来的函数，tag 是操作符 token 的 tag
+
+        用 Exp 逐层叠起来时，每个操作数都要经过每一层的 Exp 和操作符的 Alternate 链；
+        这里操作数只用 parser 解析一次，之后查表得到下一个 token 的优先级，
+        climb(max_level) 只吸收优先级不低于 max_level 的操作符，右操作数递归地只吸收更高优先级的操作符
+        右操作数解析失败时，与 Exp 一样停在这个操作符之前，所以结果和 Exp 塔完全相同
+        预测模式下 expectation 不为 None，一个操作数之后没有可以吸收的操作符时，把全部操作符记为这里期望的 token
+    """
+    def __init__(self, parser, precedence_levels, combine, tag, expectation=None):
+        self.parser = parser
+        self.combine = combine
+        self.tag = tag
+        self.expectation = expectation
+        self.levels = {}
+        for level, ops in enumerate(precedence_levels):
+            for op in ops:
+                self.levels.setdefault(op, level)
+        self.lowest = len(precedence_levels) - 1
+        self.keys = set((op, tag) for op in self.levels)
+
+    def __call__(self, tokens, pos):
+        return self.climb(tokens, pos, self.lowest)
+
+    def climb(self, tokens, pos, max_level):
+        result = self.parser(tokens, pos)
+        levels = self.levels
+        while result:
+            pos = result.pos
+            if pos >= len(tokens):
+                break
+            if tokens.__class__ is TokenArray:
+                # 不是保留字时不必取出文本
+                key = token_keys[tokens.codes[pos]]
+                if isinstance(key, tuple):
+                    op, tag = key
+                elif key is self.tag:
+                    op, tag = tokens.text(pos), key
+                else:
+                    break
+            else:
+                op, tag = tokens[pos]
+            level = levels.get(op)
+            if level is None or level > max_level or tag is not self.tag:
+                break
+            if level:
+                right_result = self.climb(tokens, pos + 1, level - 1)
+            else:
+                right_result = self.parser(tokens, pos + 1)
+            if not right_result:
+                break
+            result = Result(self.combine(op)(result.value, right_result.value), right_result.pos)
+        if result and self.expectation is not None:
+            self.expectation.fail(result.pos, self.keys)
+        return result
+
+
+class Expectation:
+    """
+        预测模式下记录解析走到的最远的失败位置 pos，以及在这个位置上期望的 token (expected)
+        expected 中的元素是 FIRST 集的 key：(文本, tag) 表示一个保留字，单独的 tag 表示任意一个该 tag 的 token
+        解析失败时，最远的失败位置通常就是出错的地方，message 给出 'expected X, got Y'
+        fail 只保存各个 parser 的 key 集合的引用 (sources)，需要时 expected 才合并成一个集合
+    """
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.pos = -1
+        self.sources = []
+
+    def fail(self, pos, keys):
+        if pos > self.pos:
+            self.pos = pos
+            self.sources = [keys]
+        elif pos == self.pos:
+            self.sources.append(keys)
+
+    @property
+    def expected(self):
+        expected = set()
+        for keys in self.sources:
+            expected.update(keys)
+        return expected
+
+    def error(self, tokens, positions=None):
+        """
+            返回描述最远失败位置的 ParseError，没有记录到失败时返回 None
+            positions 是 lexer.imp_lex_located 给出的 (行号, 列号)
+        """
+        pos = self.pos
+        if pos < 0:
+            return None
+        line = column = None
+        if positions and pos < len(positions):
+            line, column = positions[pos]
+        got = "'%s'" % tokens[pos][0] if pos < len(tokens) else 'end of input'
+        expected = sorted("'%s'" % key[0] if isinstance(key, tuple) else key for key in self.expected)
+        return ParseError(pos, expected, got, line, column)
+
+    def message(self, tokens, positions=None):
+        error = self.error(tokens, positions)
+        return str(error) if error is not None else None
+
+
+class ParseError(ValueError):
+    """
+        pos 是出错的 token 的下标，expected 是期望的 token 的描述的 list，got 是实际的 token 的描述
+        line / column 是出错位置的行号和列号，不知道时为 None
+    """
+    def __init__(self, pos, expected, got, line=None, column=None):
+        if line is not None:
+            where = 'line %d, column %d' % (line, column)
+        else:
+            where = 'token %d' % pos
+        ValueError.__init__(self, '%s: expected %s, got %s' % (where, ' or '.join(expected) or 'nothing', got))
+        self.pos = pos
+        self.expected = expected
+        self.got = got
+        self.line = line
+        self.column = column
+
+
+class Expect(Parser):
+    """
+        包住一个 Reserved 或 Tag，失败时把它期望的 token 记录到 Expectation 中
+    """
+    def __init__(self, parser, expectation):
+        self.parser = parser
+        self.expectation = expectation
+        self.keys = first(parser)[0]
+
+    def __call__(self, tokens, pos):
+        result = self.parser(tokens, pos)
+        if not result:
+            self.expectation.fail(pos, self.keys)
+        return result
+
+
+class Dispatch(Parser):
+    """
+        预测分支 (LL(1))：与 Alternate 链一样按顺序尝试 alternatives，但先查当前 token，
+        只尝试 FIRST 集中包含这个 token 的分支 (以及可能不消耗 token、FIRST 集未知的分支)
+        分支表在第一次调用时才建立，这时语法中的 Lazy 都已经生成了 parser
+    """
+    def __init__(self, alternatives, expectation=None):
+        self.alternatives = alternatives
+        self.expectation = expectation
+        self.table = None
+
+    def prepare(self):
+        """
+            table 是 token -> 分支列表 (保留字)，tags 是 tag -> 分支列表 (其它 token)，
+            default 是 FIRST 集里没有当前 token 时 (包括输入结束时) 仍然要尝试的分支
+        """
+        entries = [(parser,) + first(parser) for parser in self.alternatives]
+        known = set()
+        for _, keys, _ in entries:
+            known.update(keys or ())
+
+        def candidates(key):
+            return [parser for parser, keys, nullable in entries
+                    if keys is None or nullable or key in keys or
+                    (isinstance(key, tuple) and key[1] in keys)]
+
+        self.tags = {}
+        table = {}
+        for key in known:
+            if isinstance(key, tuple):
+                table[key] = candidates(key)
+            else:
+                self.tags[key] = candidates(key)
+        self.default = [parser for parser, keys, nullable in entries if keys is None or nullable]
+        self.expected = known
+        # TokenArray 用 token 编号查表
+        self.codes = dict((token_code(key), candidates) for key, candidates in table.items())
+        self.table = table
+        return table
+
+    def __call__(self, tokens, pos):
+        table = self.table
+        if table is None:
+            table = self.prepare()
+        if tokens.__class__ is TokenArray:
+            if pos < len(tokens.codes):
+                code = tokens.codes[pos]
+                candidates = self.codes.get(code)
+                if candidates is None:
+                    candidates = self.tags.get(token_tags[code], self.default)
+            else:
+                candidates = self.default
+        elif pos < len(tokens):
+            token = tokens[pos]
+            candidates = table.get(token)
+            if candidates is None:
+                candidates = self.tags.get(token[1], self.default)
+        else:
+            candidates = self.default
+        for parser in candidates:
+            result = parser(tokens, pos)
+            if result:
+                return result
+        if not candidates and self.expectation is not None:
+            self.expectation.fail(pos, self.expected)
+        return None
+
+
+def first(parser, visiting=None):
+    """
+        parser 的 FIRST 集，返回 (keys, nullable)
+        keys 是 parser 成功时第一个 token 可能的 key 的集合，为 None 表示不知道 (任何 token 都可能)，
+        nullable 表示 parser 可能不消耗任何 token 就成功
+        还没有生成 parser 的 Lazy、不认识的 Parser 子类和循环引用都按不知道处理
+    """
+    if visiting is None:
+        visiting = set()
+    if id(parser) in visiting:
+        return None, True
+    visiting.add(id(parser))
+    try:
+        if isinstance(parser, Reserved):
+            return set([(parser.value, parser.tag)]), False
+        if isinstance(parser, Tag):
+            return set([parser.tag]), False
+        if isinstance(parser, Concat):
+            keys, nullable = first(parser.left, visiting)
+            if nullable:
+                right_keys, nullable = first(parser.right, visiting)
+                keys = None if keys is None or right_keys is None else keys | right_keys
+            return keys, nullable
+        if isinstance(parser, (Alternate, Dispatch)):
+            if isinstance(parser, Alternate):
+                alternatives = [parser.left, parser.right]
+            else:
+                alternatives = parser.alternatives
+            keys, nullable = set(), False
+            for alternative in alternatives:
+                alternative_keys, alternative_nullable = first(alternative, visiting)
+                keys = None if keys is None or alternative_keys is None else keys | alternative_keys
+                nullable = nullable or alternative_nullable
+            return keys, nullable
+        if isinstance(parser, (Opt, Rep)):
+            return first(parser.parser, visiting)[0], True
+        if isinstance(parser, Lazy):
+            if not parser.parser:
+                return None, True
+            return first(parser.parser, visiting)
+        if isinstance(parser, (Process, Phrase, Exp, Precedence, Memo, Locate, TraceRule, TraceNode, Expect)):
+            return first(parser.parser, visiting)
+        return None, True
+    finally:
+        visiting.discard(id(parser))
+
+
+def predictive(parser, expectation=None):
+    """
+        返回一个规则的预测版本：Alternate 链换成 Dispatch，Reserved / Tag 换成 Expect，Precedence 记录期望的操作符
+        不修改原来的节点 (有改动的节点复制一份)，不进入 Lazy 和其它规则 (它们各自改写过)
+        直接嵌套的 Dispatch (没有 Memo 等包装的规则，比如 aexp_term 中的 aexp_value) 把分支合并进来，只查一次表
+    """
+    copies = {}
+
+    def alternatives(node, result):
+        if isinstance(node, Alternate):
+            alternatives(node.left, result)
+            alternatives(node.right, result)
+        elif isinstance(node, Dispatch):
+            result.extend(node.alternatives)
+        else:
+            result.append(rewrite(node))
+        return result
+
+    def rewrite(node):
+        new = copies.get(id(node))
+        if new is not None:
+            return new
+        if isinstance(node, Alternate):
+            new = Dispatch(alternatives(node, []), expectation)
+        elif isinstance(node, (Reserved, Tag)):
+            new = Expect(node, expectation) if expectation is not None else node
+        elif isinstance(node, Precedence) and expectation is not None:
+            new = copy(node)
+            new.parser = rewrite(node.parser)
+            new.expectation = expectation
+        elif isinstance(node, (Lazy, Dispatch, Expect, Memo, Locate, TraceRule)):
+            new = node
+        else:
+            new = node
+            for name in ('left', 'right', 'parser', 'separator'):
+                child = getattr(node, name, None)
+                if isinstance(child, Parser):
+                    rewritten = rewrite(child)
+                    if rewritten is not child:
+                        if new is node:
+                            new = copy(node)
+                        setattr(new, name, rewritten)
+        copies[id(node)] = new
+        return new
+
+    return rewrite(parser)
+
+
+class RuleStats:
+    """
+        一个语法规则的统计：
+        calls / failures 是规则被调用和失败的次数，backtracks 是规则内的 Alternate 左边失败、回到原位置改试右边的次数
+        total 是包括其它规则在内的累计耗时 (递归调用只计最外层)，own 是去掉其中调用的其它规则之后的耗时 (秒)
+        combinators 是 组合子类名 -> [调用次数, 失败次数]，只统计直接属于本规则的组合子
+    """
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.failures = 0
+        self.backtracks = 0
+        self.total = 0.0
+        self.own = 0.0
+        self.combinators = {}
+        self.active = 0
+
+
+class ParseTrace:
+    """
+        解析过程的跟踪记录，按规则名汇总，多次解析的结果累计在一起，reset 清空
+        stack 是正在解析的规则的栈，每项是 [RuleStats, 其中调用的其它规则的耗时]
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.rules = {}
+        self.top = self.rule('<top>')
+        self.stack = []
+
+    def rule(self, name):
+        stats = self.rules.get(name)
+        if stats is None:
+            stats = self.rules[name] = RuleStats(name)
+        return stats
+
+    def report(self, limit=None):
+        """
+            按规则自身耗时从大到小排序的汇总报告，每个规则下列出调用最多的组合子
+        """
+        lines = ['%-14s %8s %8s %8s %10s %10s' % ('rule', 'calls', 'fails', 'backtrk', 'total ms', 'self ms')]
+        ordered = sorted(self.rules.values(), key=lambda stats: stats.own, reverse=True)
+        for stats in ordered[:limit]:
+            if not stats.calls and not stats.combinators:
+                continue
+            lines.append('%-14s %8d %8d %8d %10.3f %10.3f' % (stats.name, stats.calls, stats.failures,
+                                                              stats.backtracks, stats.total * 1e3,
+                                                              stats.own * 1e3))
+            combinators = sorted(stats.combinators.items(), key=lambda item: -item[1][0])
+            lines.append('    ' + ', '.join('%s %d/%d' % (kind, calls, failures)
+                                            for kind, (calls, failures) in combinators))
+        return '\n'.join(lines)
+
+
+class TraceRule(Parser):
+    """
+        跟踪一个语法规则：调用次数、失败次数和耗时
+    """
+    def __init__(self, parser, trace, name):
+        self.parser = parser
+        self.trace = trace
+        self.name = name
+
+    def __call__(self, tokens, pos):
+        trace = self.trace
+        stats = trace.rule(self.name)
+        frame = [stats, 0.0]
+        trace.stack.append(frame)
+        stats.active += 1
+        start = timer()
+        try:
+            result = self.parser(tokens, pos)
+        finally:
+            elapsed = timer() - start
+            trace.stack.pop()
+            stats.active -= 1
+            stats.calls += 1
+            if not stats.active:
+                stats.total += elapsed
+            stats.own += elapsed - frame[1]
+            if trace.stack:
+                trace.stack[-1][1] += elapsed
+        if not result:
+            stats.failures += 1
         return result
 
 
+class TraceNode(Parser):
+    """
+        跟踪一个组合子：调用和失败次数记到当前规则下
+        backtrack 为真表示它是某个 Alternate 的左边，失败之后 Alternate 会回到原位置改试右边
+    """
+    def __init__(self, parser, trace, backtrack=False):
+        self.parser = parser
+        self.trace = trace
+        self.kind = parser.__class__.__name__
+        self.backtrack = backtrack
+
+    def __call__(self, tokens, pos):
+        trace = self.trace
+        stats = trace.stack[-1][0] if trace.stack else trace.top
+        counts = stats.combinators.get(self.kind)
+        if counts is None:
+            counts = stats.combinators[self.kind] = [0, 0]
+        counts[0] += 1
+        result = self.parser(tokens, pos)
+        if not result:
+            counts[1] += 1
+            if self.backtrack:
+                stats.backtracks += 1
+        return result
+
+
+def trace_graph(parser, trace):
+    """
+        复制以 parser 为根的解析器图，副本中每一条父子引用都换成 TraceNode，返回包装过的根
+        TraceRule 本身不包装，它下面的组合子照常包装
+        不能原地修改：primitive.num 这样的模块级 parser 同时属于各个模式的语法图
+    """
+    copies = {}
+
+    def trace_copy(node):
+        new = copies.get(id(node))
+        if new is not None:
+            return new
+        new = copies[id(node)] = copy(node)
+        for name in ('left', 'right', 'parser', 'separator'):
+            child = getattr(node, name, None)
+            if isinstance(child, Parser):
+                child = trace_copy(child)
+                if not isinstance(child, TraceRule):
+                    backtrack = isinstance(node, Alternate) and name == 'left'
+                    child = TraceNode(child, trace, backtrack)
+                setattr(new, name, child)
+        if isinstance(node, Dispatch):
+            new.alternatives = [alternative if isinstance(alternative, TraceRule)
+                                else TraceNode(alternative, trace, True)
+                                for alternative in map(trace_copy, node.alternatives)]
+            new.table = None
+        return new
+
+    root = trace_copy(parser)
+    if isinstance(root, TraceRule):
+        return root
+    return TraceNode(root, trace)
+
+
+def walk(parser):
+    """
+        遍历以 parser 为根的整个解析器图，每个节点只 yield 一次
+        遇到还没有生成 parser 的 Lazy 节点时，立即生成，所以遍历之后图就固定下来了
+    """
+    seen = set()
+    stack = [parser]
+    while stack:
+        node = stack.pop()
+        if id(node) in seen:
+            continue
+        seen.add(id(node))
+        if isinstance(node, Lazy) and not node.parser:
+            node.parser = node.parser_func()
+        yield node
+        for name in ('left', 'right', 'parser', 'separator'):
+            child = getattr(node, name, None)
+            if isinstance(child, Parser):
+                stack.append(child)
+        if isinstance(node, Dispatch):
+            stack.extend(node.alternatives)
+
+
 if __name__ == '__main__':
     import lexer
     s = 'a ; b ; c'
@@ -256,3 +947,14 @@ if __name__ == '__main__':
     res2 = np2(tokens, result.pos)
     # output: Result((';', 'b'), 3)
     print res2
+
+    # 预测模式的错误信息：最远的失败位置上，分隔符 / 括号和二元操作符都是期望的 token
+    import primitive
+    for text, expected in [('x := 1 y := 2', ["'*'", "'+'", "'-'", "'/'", "';'"]),
+                           ('x := (1 y', ["')'", "'*'", "'+'", "'-'", "'/'"])]:
+        tokens = lexer.imp_lex(text)
+        primitive.imp_parse(tokens, predict=True)
+        error = primitive.expectation.error(tokens)
+        # output: token 3: expected '*' or '+' or '-' or '/' or ';', got 'y'
+        print error
+        assert error.expected == expected, error.expected
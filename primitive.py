@@ -3,6 +3,68 @@
 from lexer import *
 from parser import *
 from ast import *
+from functools import wraps
+
+"""
+    语法只构造一次：每个规则函数生成的 parser 按 (规则名, 模式) 缓存起来，
+    再次调用同一个规则函数 (包括 Lazy 中的调用) 得到的都是同一个共享实例，
+    parser() 返回的整棵语法图也会缓存，并且构造时就把全部 Lazy 节点解析掉，之后不再变化
+
+    packrat 模式：imp_parse(tokens, packrat=True) 时，使用另一套语法图，
+    其中每个规则生成的 parser 外面包一层 Memo
+    所有规则共用 memo_table，每次解析结束后清空，命中率等统计见 memo_table
+
+    定位模式：imp_parse_located 使用第三套语法图，其中每个规则生成的 parser 外面包一层 Locate，
+    记录每个规则解析出的语法树节点的起始 token，供 profiler 按源码位置统计
+
+    跟踪模式：imp_parse(tokens, trace=True) 时，每个规则外面包一层 TraceRule，
+    语法图中其余的每个组合子也包一层 TraceNode，统计每个规则的调用、失败、回溯次数和耗时，
+    结果累计在 parse_trace 中，parse_trace.report() 输出汇总报告，parse_trace.reset() 清空
+
+    预测模式：imp_parse(tokens, predict=True) 时，每个规则中的 Alternate 链都换成按当前 token 查表的 Dispatch，
+    只尝试 FIRST 集包含这个 token 的分支，比如 stmt 看到 while 就直接进入 while_stmt；
+    解析失败时 expectation 记录了最远的失败位置和这里期望的 token，expectation.message(tokens) 给出错误信息
+    记录期望的 token 要在每个 token 的比较失败时调用 expectation.fail，代价抵消了 Dispatch 省下的时间，
+    所以预测模式先用不记录的语法图解析，只有解析失败时才用记录期望 token 的另一套语法图 (expect_mode) 再解析一次
+"""
+packrat_mode = False
+memo_table = MemoTable()
+locate_mode = False
+location_table = LocationTable()
+trace_mode = False
+parse_trace = ParseTrace()
+predict_mode = False
+expect_mode = False
+expectation = Expectation()
+rules = {}
+grammars = {}
+
+def rule(func):
+    """
+        语法规则装饰器，按 (规则名, 模式) 缓存规则生成的 parser
+        预测模式下先改写为 Dispatch 分支 (expect_mode 时同时记录期望的 token)；packrat 模式下用 Memo 包装，以规则名作为 key；
+        定位模式下用 Locate 包装；跟踪模式下用 TraceRule 包装
+    """
+    @wraps(func)
+    def build():
+        key = (func.__name__,) + mode()
+        parser = rules.get(key)
+        if parser is None:
+            parser = func()
+            if predict_mode:
+                parser = predictive(parser, expectation if expect_mode else None)
+            if packrat_mode:
+                parser = Memo(parser, memo_table, func.__name__)
+            if locate_mode:
+                parser = Locate(parser, location_table)
+            if trace_mode:
+                parser = TraceRule(parser, parse_trace, func.__name__)
+            rules[key] = parser
+        return parser
+    return build
+
+def mode():
+    return (packrat_mode, locate_mode, trace_mode, predict_mode, expect_mode)
 
 # Basic parsers
 def keyword(kw):
@@ -24,6 +86,7 @@ id = Tag(ID)
 """
     数学表达式部分
 """
+@rule
 def aexp_value():
     """
         使用 | 即 Alternate Parser，先看左边也即是否能解析为整数表达式
@@ -33,6 +96,7 @@ def aexp_value():
     return (num ^ (lambda i: IntAexp(i))) | \
            (id  ^ (lambda v: VarAexp(v)))
 
+@rule
 def aexp_group():
     """
         匹配括号，先把 (、aexp、) 三部分调用 Concat，得到 ('(', aexp), ')')
@@ -47,6 +111,7 @@ def process_group(parsed):
     ((_, p), _) = parsed
     return p
 
+@rule
 def aexp_term():
     """
         定义 aexp_term，要么是整数/变量，要么是括号
@@ -82,6 +147,14 @@ def precedence(value_parser, precedence_levels, combine):
     """
         value_parser 是一个解析器，可以读取 aexp_term，也就是数字、变量、括号
         precedence_levels 就是优先级由高到低的，不同优先级为一个子列表的列表
+        combine(op) 返回合并左右两个表达式的函数
+        使用算符优先解析器 Precedence，结果与 precedence_tower 相同，但每个操作数只解析一次
+    """
+    return Precedence(value_parser, precedence_levels, combine, RESERVED)
+
+def precedence_tower(value_parser, precedence_levels, combine):
+    """
+        原来的做法：每个优先级一层 Exp 组合子，层层叠起来
     """
     def op_parser(precedence_level):
         """
@@ -100,6 +173,7 @@ def precedence(value_parser, precedence_levels, combine):
         parser = parser * op_parser(precedence_level)
     return parser
 
+@rule
 def aexp():
     """
         就是说 combine 取 process_binop，value_parser 取 aexp_term
@@ -113,6 +187,7 @@ def aexp():
 """
     逻辑表达式部分
 """
+@rule
 def bexp_not():
     """
         Not 表达式，同样需要 lazy，是因为 bexp_term 实际上包括 bexp_not，避免循环调用
@@ -123,6 +198,7 @@ def process_relop(parsed):
     ((left, op), right) = parsed
     return RelopBexp(op, left, right)
 
+@rule
 def bexp_relop():
     """
         比较表达式
@@ -130,12 +206,14 @@ def bexp_relop():
     relops = ['<', '<=', '>', '>=', '=', '!=']
     return aexp() + any_operator_in_list(relops) + aexp() ^ process_relop
 
+@rule
 def bexp_group():
     """
        括号表达式，lazy是因为 bexp 包括 bexp_group
     """
     return keyword('(') + Lazy(bexp) + keyword(')') ^ process_group
 
+@rule
 def bexp_term():
     """
         逻辑表达式基本组成部分：not、比较、括号
@@ -160,6 +238,7 @@ bexp_precedence_levels = [
     ['or'],
 ]
 
+@rule
 def bexp():
     """
         类似数学表达式，使用 Exp 组合算子来按优先级递归调用表达式
@@ -172,6 +251,7 @@ def bexp():
 """
     声明语句
 """
+@rule
 def assign_stmt():
     """
         赋值语句
@@ -181,14 +261,27 @@ def assign_stmt():
         return AssignStatement(name, exp)
     return id + keyword(':=') + aexp() ^ process
 
+@rule
 def stmt_list():
     """
         组合语句，使用 Exp 组合子
         separator 是一个高阶函数，分隔符左右来组成组合语句
+        多条语句组成一个扁平的 Block，只有一条语句时就是这条语句本身
     """
-    separator = keyword(';') ^ (lambda x: lambda l, r: CompoundStatement(l, r))
+    separator = keyword(';') ^ (lambda x: process_sequence)
     return Exp(stmt(), separator)
 
+def process_sequence(first, second):
+    """
+        Exp 从左到右折叠：第一次遇到分号时新建 Block，之后直接追加到这个 Block 中
+        stmt 的结果不会是 Block，所以被追加的 Block 一定是本次 Exp 调用自己新建的
+    """
+    if isinstance(first, Block):
+        first.statements.append(second)
+        return first
+    return Block([first, second])
+
+@rule
 def if_stmt():
     """
         麻烦点在于 else 是可选的，故此：
@@ -207,6 +300,7 @@ def if_stmt():
            Opt(keyword('else') + Lazy(stmt_list)) + \
            keyword('end') ^ process
 
+@rule
 def while_stmt():
     """
         循环体中是一个 stmt_list
@@ -218,6 +312,7 @@ def while_stmt():
            keyword('do') + Lazy(stmt_list) + \
            keyword('end') ^ process
 
+@rule
 def stmt():
     return assign_stmt() | \
            if_stmt()     | \
@@ -228,16 +323,97 @@ def stmt():
     外层 wrapper 语句
 """
 # Top level parser
-def imp_parse(tokens):
-    ast = parser()(tokens, 0)
-    return ast
+def imp_parse(tokens, packrat=False, trace=False, predict=False):
+    global packrat_mode, trace_mode, predict_mode
+    if not packrat and not trace and not predict:
+        return parser()(tokens, 0)
+    packrat_mode = packrat
+    trace_mode = trace
+    predict_mode = predict
+    try:
+        grammar = parser()
+    finally:
+        packrat_mode = trace_mode = predict_mode = False
+    if predict:
+        expectation.clear()
+    try:
+        result = grammar(tokens, 0)
+    finally:
+        if packrat:
+            memo_table.clear()
+    if predict and not result:
+        expecting_grammar(packrat, trace)(tokens, 0)
+        if packrat:
+            memo_table.clear()
+    return result
+
+def expecting_grammar(packrat=False, trace=False):
+    """
+        记录期望 token 的预测模式语法图，只在解析失败之后用来填写 expectation
+    """
+    global packrat_mode, trace_mode, predict_mode, expect_mode
+    packrat_mode = packrat
+    trace_mode = trace
+    predict_mode = expect_mode = True
+    try:
+        return parser()
+    finally:
+        packrat_mode = trace_mode = predict_mode = expect_mode = False
+
+def imp_parse_located(tokens):
+    """
+        返回 (imp_parse 的结果, locations)，locations 是 (节点, 节点起始 token 的下标) 的 list，
+        只包含结果语法树中由某个规则直接解析出的节点 (Precedence 中组合出的内层二元运算没有记录)
+    """
+    global locate_mode
+    locate_mode = True
+    try:
+        grammar = parser()
+    finally:
+        locate_mode = False
+    try:
+        result = grammar(tokens, 0)
+        locations = []
+        if result:
+            stack = [result.value]
+            while stack:
+                node = stack.pop()
+                pos = location_table.position(node)
+                if pos is not None:
+                    locations.append((node, pos))
+                stack.extend(children(node))
+        return result, locations
+    finally:
+        location_table.clear()
+
+def predictive_rules(*funcs):
+    """
+        记录期望 token 的预测模式下的规则实例，比如 predictive_rules(stmt, bexp)，供 recovery 单独解析程序的一部分
+    """
+    global predict_mode, expect_mode
+    predict_mode = expect_mode = True
+    try:
+        parser()
+        return [func() for func in funcs]
+    finally:
+        predict_mode = expect_mode = False
 
 def parser():
     """
         一个程序只不过是一个语句列表
         Phrase组合子保证我们用到了文件的每一个标记符
-    """
-    return Phrase(stmt_list())
+        语法图按模式缓存，第一次构造时遍历一遍，把 Lazy 全部解析为共享的规则实例
+    """
+    key = mode()
+    grammar = grammars.get(key)
+    if grammar is None:
+        grammar = Phrase(stmt_list())
+        for _ in walk(grammar):
+            pass
+        if trace_mode:
+            grammar = trace_graph(grammar, parse_trace)
+        grammars[key] = grammar
+    return grammar
 
 
 if __name__ == '__main__':
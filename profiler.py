@@ -0,0 +1,190 @@
+# encoding: utf-8
+
+import sys
+from timeit import default_timer as timer
+
+from ast import *
+from equality import Equality
+from lexer import imp_lex_located
+from primitive import imp_parse_located
+
+"""
+    按源码位置统计每个语法树节点 (语句、算术表达式、逻辑表达式) 的执行次数和耗时
+
+    Profiler 复制一份语法树，把每个节点包在一个 Probe 中，Probe.eval 计时之后再调用节点本身的 eval，
+    所以只对这份复制出来的语法树生效，原来的语法树和 ast.eval 没有任何额外开销
+    节点的源码位置来自 imp_lex_located 记录的 token 行列号和 imp_parse_located 记录的节点起始 token，
+    没有记录的节点 (Precedence 中组合出的内层二元运算) 使用它最左边的子节点的位置
+
+    report() 是按自身耗时排序的平铺报告，collapsed() 是 flamegraph.pl 等工具接受的折叠栈格式：
+        Block@1:1;WhileStatement@3:1;AssignStatement@4:5 1234
+    每行是一条调用栈和栈顶节点的自身耗时 (微秒)
+
+    用法：python profiler.py 文件 [-c]，-c 时输出折叠栈
+"""
+
+
+class NodeStats(object):
+    """
+        一个节点的统计：count 是执行次数，total 是包括子节点在内的累计耗时，own 是去掉子节点之后的耗时 (秒)
+    """
+    __slots__ = ('node', 'label', 'location', 'count', 'total', 'own')
+
+    def __init__(self, node, label, location):
+        self.node = node
+        self.label = label
+        self.location = location
+        self.count = 0
+        self.total = 0.0
+        self.own = 0.0
+
+    def frame(self):
+        if self.location is None:
+            return self.label
+        return '%s@%d:%d' % ((self.label,) + self.location)
+
+
+class Probe(object):
+    """
+        包住一个节点，eval 时计时并记录到 stats 和 profiler 的调用栈中
+    """
+    __slots__ = ('profiler', 'node', 'stats')
+
+    def __init__(self, profiler, node, stats):
+        self.profiler = profiler
+        self.node = node
+        self.stats = stats
+
+    def eval(self, env):
+        profiler = self.profiler
+        frames = profiler.frames
+        stats = self.stats
+        # frame: [从根到本节点的栈, 子节点的累计耗时]
+        frame = [frames[-1][0] + (stats,) if frames else (stats,), 0.0]
+        frames.append(frame)
+        start = timer()
+        try:
+            return self.node.eval(env)
+        finally:
+            elapsed = timer() - start
+            frames.pop()
+            own = elapsed - frame[1]
+            stats.count += 1
+            stats.total += elapsed
+            stats.own += own
+            if frames:
+                frames[-1][1] += elapsed
+            stacks = profiler.stacks
+            stacks[frame[0]] = stacks.get(frame[0], 0.0) + own
+
+
+def label(node):
+    op = getattr(node, 'op', None)
+    if op is not None:
+        return '%s(%s)' % (node.__class__.__name__, op)
+    return node.__class__.__name__
+
+
+class Profiler:
+    """
+        locations 是 id(节点) -> (行号, 列号)，见 parse_located
+        run(env) 执行程序并累计统计，可以执行多次
+    """
+    def __init__(self, stmt, locations=None):
+        self.stmt = stmt
+        self.locations = locations or {}
+        self.stats = []
+        self.stacks = {}
+        self.frames = []
+        self.root = self.probe(stmt)
+
+    def location(self, node):
+        location = self.locations.get(id(node))
+        if location is None:
+            for child in children(node):
+                location = self.location(child)
+                if location is not None:
+                    break
+        return location
+
+    def probe(self, node):
+        """
+            复制节点，子节点都换成 Probe，再把复制出的节点包在一个 Probe 中
+        """
+        stats = NodeStats(node, label(node), self.location(node))
+        self.stats.append(stats)
+        copy = node.__class__.__new__(node.__class__)
+        for name in node.fields():
+            value = getattr(node, name)
+            if isinstance(value, Equality):
+                value = self.probe(value)
+            elif isinstance(value, list):
+                value = [self.probe(item) for item in value]
+            setattr(copy, name, value)
+        return Probe(self, copy, stats)
+
+    def run(self, env=None):
+        if env is None:
+            env = {}
+        self.root.eval(env)
+        return env
+
+    def report(self, limit=None):
+        """
+            按自身耗时从大到小排序的平铺报告
+        """
+        lines = ['%-10s %-22s %10s %12s %12s' % ('location', 'node', 'count', 'total ms', 'self ms')]
+        ordered = sorted((stats for stats in self.stats if stats.count),
+                         key=lambda stats: stats.own, reverse=True)
+        for stats in ordered[:limit]:
+            location = '%d:%d' % stats.location if stats.location else '-'
+            lines.append('%-10s %-22s %10d %12.3f %12.3f' % (location, stats.label, stats.count,
+                                                              stats.total * 1e3, stats.own * 1e3))
+        return '\n'.join(lines)
+
+    def collapsed(self):
+        """
+            折叠栈格式，每行 '帧;帧;帧 自身耗时微秒'，不足 1 微秒的栈省略
+        """
+        lines = []
+        for stack, own in sorted(self.stacks.items(), key=lambda item: -item[1]):
+            microseconds = int(round(own * 1e6))
+            if microseconds > 0:
+                lines.append('%s %d' % (';'.join(stats.frame() for stats in stack), microseconds))
+        return '\n'.join(lines)
+
+
+def parse_located(text):
+    """
+        解析 text，返回 (语法树, locations)，locations 是 id(节点) -> (行号, 列号)；解析失败时语法树为 None
+    """
+    tokens, positions = imp_lex_located(text)
+    result, located = imp_parse_located(tokens)
+    if not result:
+        return None, {}
+    locations = dict((id(node), positions[pos]) for node, pos in located)
+    return result.value, locations
+
+
+def profile(text, env=None):
+    """
+        解析并在 profiling 模式下执行 text，返回 Profiler
+    """
+    stmt, locations = parse_located(text)
+    if stmt is None:
+        raise ValueError('parse error')
+    profiler = Profiler(stmt, locations)
+    profiler.run(env)
+    return profiler
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        sys.stderr.write('usage: python profiler.py file [-c]\n')
+        sys.exit(1)
+    with open(sys.argv[1]) as file:
+        result = profile(file.read())
+    if '-c' in sys.argv[2:]:
+        print result.collapsed()
+    else:
+        print result.report()
@@ -0,0 +1,170 @@
+# encoding: utf-8
+
+import sys
+
+from ast import Block
+from lexer import RESERVED, imp_lex, imp_lex_located
+from parser import ParseError
+from primitive import bexp, expectation, expecting_grammar, imp_parse, predictive_rules, stmt
+
+"""
+    给长期运行的服务用的 lex 和 parse：出错时不退出进程，而是抛出 (或者收集) 带行号列号的异常
+
+    parse(text) 返回语法树，出错时抛出 lexer.LexError 或 parser.ParseError
+    正确的程序走的是普通的 imp_lex + imp_parse，只有出错之后才带位置重新 lex、用预测模式重新解析来定位错误
+
+    check(text) 一遍找出全部错误：lexer 跳过非法字符继续扫描，
+    parser 按顶层的 ; 把程序分成语句逐条解析，一条语句出错之后从下一个 ; 处重新同步；
+    出错的 if / while 语句如果 then / do / else / end 的结构是完整的，就分别检查条件和 end 之前的每个语句序列，
+    这样一个循环体中的多个错误也都能找到
+    命令行用法：python recovery.py 文件...，输出 文件:行:列: 错误信息，有错误时以 1 退出
+"""
+
+
+def parse(text):
+    """
+        返回 text 的语法树，出错时抛出 LexError 或 ParseError
+    """
+    result = imp_parse(imp_lex(text))
+    if result:
+        return result.value
+    tokens, positions = located(text)
+    expectation.clear()
+    expecting_grammar()(tokens, 0)
+    raise expectation.error(tokens, positions) or ParseError(0, [], 'parse failure')
+
+
+def located(text, errors=None):
+    """
+        imp_lex_located，positions 的末尾多加一项输入结束处的位置，错误在输入末尾时也有行号列号
+    """
+    tokens, positions = imp_lex_located(text, errors)
+    positions.append((text.count('\n') + 1, len(text) - text.rfind('\n')))
+    return tokens, positions
+
+
+def check(text):
+    """
+        返回 (语法树, errors)，errors 是按位置排序的 LexError 和 ParseError，有错误时语法树为 None
+    """
+    errors = []
+    tokens, positions = located(text, errors)
+    checker = Checker(tokens, positions)
+    ast = checker.block(0, len(tokens))
+    errors.extend(checker.errors)
+    errors.sort(key=lambda error: (error.line, error.column))
+    return (ast if not errors else None), errors
+
+
+class Checker:
+    """
+        逐条语句解析 tokens，出错时记录 ParseError 并从下一个语句继续
+    """
+    def __init__(self, tokens, positions):
+        self.tokens = tokens
+        self.positions = positions
+        self.errors = []
+        self.stmt, self.bexp = predictive_rules(stmt, bexp)
+
+    def keyword(self, index, *texts):
+        token = self.tokens[index]
+        return token[1] is RESERVED and token[0] in texts
+
+    def separators(self, lo, hi):
+        """
+            tokens[lo:hi] 中嵌套深度为 0 的 ; 的下标；多出来的 end 不会让深度变成负数
+        """
+        result = []
+        depth = 0
+        for index in xrange(lo, hi):
+            if self.keyword(index, ';'):
+                if depth == 0:
+                    result.append(index)
+            elif self.keyword(index, 'if', 'while'):
+                depth += 1
+            elif self.keyword(index, 'end') and depth:
+                depth -= 1
+        return result
+
+    def block(self, lo, hi):
+        """
+            把 tokens[lo:hi] 作为 ; 分隔的语句序列解析，有错误的语句为 None，这时返回 None
+        """
+        statements = []
+        for end in self.separators(lo, hi) + [hi]:
+            statements.append(self.statement(lo, end))
+            lo = end + 1
+        if None in statements:
+            return None
+        if len(statements) == 1:
+            return statements[0]
+        return Block(statements)
+
+    def attempt(self, parser, lo, hi, follow):
+        """
+            用 parser 解析 tokens[lo:hi]，必须正好用完这些 token；失败时记录错误，
+            只解析了一部分时，在停下的地方期望的是 follow
+        """
+        expectation.clear()
+        result = parser(self.tokens, lo)
+        if result and result.pos == hi:
+            return result
+        if result:
+            expectation.fail(result.pos, [(follow, RESERVED)])
+        self.errors.append(expectation.error(self.tokens, self.positions))
+        return None
+
+    def statement(self, lo, hi):
+        count = len(self.errors)
+        if lo < hi and self.keyword(lo, 'if', 'while'):
+            expectation.clear()
+            result = self.stmt(self.tokens, lo)
+            if result and result.pos == hi:
+                return result.value
+            # 结构完整时分别检查各部分，能找到其中的全部错误
+            if self.compound(lo, hi) and len(self.errors) > count:
+                return None
+        result = self.attempt(self.stmt, lo, hi, ';')
+        return result.value if result else None
+
+    def compound(self, lo, hi):
+        """
+            tokens[lo:hi] 是 if 条件 then 语句 [else 语句] end 或者 while 条件 do 语句 end 时，
+            分别检查条件和各个语句序列，返回 True；结构不完整时返回 False
+        """
+        loop = self.keyword(lo, 'while')
+        middle = other = None
+        depth = 0
+        for index in xrange(lo + 1, hi):
+            if self.keyword(index, 'if', 'while'):
+                depth += 1
+            elif self.keyword(index, 'end'):
+                if depth == 0:
+                    break
+                depth -= 1
+            elif depth == 0 and middle is None and self.keyword(index, 'do' if loop else 'then'):
+                middle = index
+            elif depth == 0 and middle is not None and not loop and other is None and \
+                    self.keyword(index, 'else'):
+                other = index
+        else:
+            return False
+        if middle is None or index != hi - 1:
+            return False
+        self.attempt(self.bexp, lo + 1, middle, 'do' if loop else 'then')
+        self.block(middle + 1, other if other is not None else index)
+        if other is not None:
+            self.block(other + 1, index)
+        return True
+
+
+if __name__ == '__main__':
+    failed = False
+    for path in sys.argv[1:]:
+        with open(path) as file:
+            _, errors = check(file.read())
+        for error in errors:
+            failed = True
+            message = str(error).split(': ', 1)[1]
+            print '%s:%d:%d: %s' % (path, error.line, error.column, message)
+    sys.exit(1 if failed else 0)
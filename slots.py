@@ -0,0 +1,106 @@
+# encoding: utf-8
+
+from ast import *
+from closures import ClosureCompiler
+
+"""
+    基于槽位的变量空间
+    先做一遍变量解析，给程序中出现的每个变量名分配一个固定的整数槽位，
+    执行时 env 不再是 dict，而是按槽位下标访问的 list，省去了每次访问时字符串的哈希和查找，
+    同时一份程序状态只是一个定长的 list，比 dict 紧凑得多
+    槽位初始为 None，表示还没有赋值：读取时当作 0，转回 dict 时不出现，与 eval 的结果一致
+"""
+
+
+def resolve(node, names=None):
+    """
+        按第一次出现的顺序，收集语法树中所有的变量名 (赋值目标和被读取的变量)
+    """
+    if names is None:
+        names = []
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, VarAexp):
+            name = node.name
+        elif isinstance(node, AssignStatement):
+            name = node.name
+        else:
+            name = None
+        if name is not None and name not in names:
+            names.append(name)
+        stack.extend(reversed(children(node)))
+    return names
+
+
+class SlotCompiler(ClosureCompiler):
+    """
+        与 ClosureCompiler 相同，只是变量的读写换成了按槽位下标访问 list
+    """
+    def __init__(self, slots):
+        self.slots = slots
+
+    def load(self, name):
+        index = self.slots[name]
+
+        def run(env):
+            return env[index] or 0
+        return run
+
+    def store(self, name, value):
+        index = self.slots[name]
+
+        def run(env):
+            env[index] = value(env)
+        return run
+
+
+class SlotProgram:
+    """
+        编译好的槽位模式程序
+        names[i] 是槽位 i 对应的变量名，run 返回执行后的槽位 list，as_dict 把它转回 dict
+    """
+    def __init__(self, stmt):
+        self.names = resolve(stmt)
+        self.slots = dict((name, index) for index, name in enumerate(self.names))
+        self.code = SlotCompiler(self.slots).compile(stmt)
+
+    def new_env(self, env=None):
+        values = [None] * len(self.names)
+        if env:
+            for name, value in env.items():
+                if name in self.slots:
+                    values[self.slots[name]] = value
+        return values
+
+    def run(self, env=None):
+        values = self.new_env(env)
+        self.code(values)
+        return values
+
+    def as_dict(self, values, env=None):
+        """
+            槽位 list 的 dict 视图；env 中不属于本程序的变量原样保留
+        """
+        result = dict(env) if env else {}
+        for name, value in zip(self.names, values):
+            if value is not None:
+                result[name] = value
+        return result
+
+    def eval(self, env):
+        """
+            与 stmt.eval(env) 用法相同：执行之后把结果写回 env
+        """
+        env.update(self.as_dict(self.run(env)))
+
+
+if __name__ == '__main__':
+    from lexer import imp_lex
+    from primitive import imp_parse
+    text = 'n := 10; i := 0; while i < n do s := s + i * 2; i := i + 1 end'
+    program = SlotProgram(imp_parse(imp_lex(text)).value)
+    values = program.run()
+    print program.names
+    print values
+    print program.as_dict(values)
@@ -0,0 +1,191 @@
+# encoding: utf-8
+
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from multiprocessing import Pool
+
+import batch
+from ast import AssignStatement, IfStatement, WhileStatement
+from benchmark import best_of
+from generator import generate
+from lexer import imp_lex
+from primitive import imp_parse
+from profiler import Profiler
+
+"""
+    可重复的性能回归测试：在 generator 用固定 seed 生成的一组程序上，
+    分别测量 imp_lex 和 imp_parse 每秒处理的 token 数、执行时每秒执行的语句数，以及峰值内存
+    每个用例在一个新的子进程中运行；fork 出的子进程的 ru_maxrss 包含从父进程继承来的内存，
+    所以峰值内存报告的是用例结束时的 ru_maxrss 减去子进程开始时的 ru_maxrss，即这个用例使峰值增加了多少
+
+    用法：
+        python suite.py -o results.json                 # 运行并保存结果
+        python suite.py --compare results.json          # 与保存的结果对比，变慢超过阈值时以 1 退出
+"""
+
+cases = [
+    ('small', dict(seed=1, statements=50)),
+    ('large', dict(seed=2, statements=2000)),
+    ('deep_expressions', dict(seed=3, statements=200, expr_depth=6)),
+    ('nested_loops', dict(seed=4, statements=60, nesting=3, iterations=8)),
+]
+
+# 对比时用来判断回归的指标：吞吐量越大越好，内存越小越好
+throughput_metrics = ['lex_tokens_per_s', 'parse_tokens_per_s', 'eval_statements_per_s']
+memory_metrics = ['peak_rss_delta_kb']
+
+
+def executed_statements(ast):
+    """
+        一次执行中执行的语句条数 (赋值、if、while)，用 Profiler 数出来
+    """
+    profiler = Profiler(ast)
+    profiler.run()
+    return sum(stats.count for stats in profiler.stats
+               if isinstance(stats.node, (AssignStatement, IfStatement, WhileStatement)))
+
+
+def per_call(func, repeat, minimum=0.2):
+    """
+        单次调用的耗时：先把调用次数加倍到一轮至少 minimum 秒，再取 repeat 轮中最快的一轮
+        小程序的一次 lex / parse / eval 只要几十微秒，单独计时误差太大
+    """
+    number = 1
+    while True:
+        def loop():
+            for _ in xrange(number):
+                func()
+        if best_of(loop, 1) >= minimum:
+            return best_of(loop, repeat) / number
+        number *= 2
+
+
+def run_case(case, engine='ast', repeat=3):
+    # Linux 上 ru_maxrss 的单位是 KB
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    name, options = case
+    options = dict(options)
+    source = generate(options.pop('seed'), **options)
+    tokens = imp_lex(source)
+    ast = imp_parse(tokens).value
+    statements = executed_statements(ast)
+    run = batch.engines[engine]
+
+    lex_time = per_call(lambda: imp_lex(source), repeat)
+    parse_time = per_call(lambda: imp_parse(tokens), repeat)
+    eval_time = per_call(lambda: run(ast, {}), repeat)
+    return name, {
+        'options': case[1],
+        'characters': len(source),
+        'tokens': len(tokens),
+        'statements': statements,
+        'lex_tokens_per_s': len(tokens) / lex_time,
+        'parse_tokens_per_s': len(tokens) / parse_time,
+        'eval_statements_per_s': statements / eval_time,
+        'peak_rss_delta_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline_rss,
+    }
+
+
+def run_case_in_child(args):
+    return run_case(*args)
+
+
+def run_suite(engine='ast', repeat=3, names=None):
+    selected = [case for case in cases if not names or case[0] in names]
+    pool = Pool(1, maxtasksperchild=1)
+    try:
+        results = pool.map(run_case_in_child, [(case, engine, repeat) for case in selected], 1)
+    finally:
+        pool.close()
+        pool.join()
+    return {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'engine': engine,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'cases': dict(results),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.STDOUT,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, current, threshold=0.1):
+    """
+        逐项对比，返回 (报告行, 是否有回归)；吞吐量比 baseline 低、或者内存比 baseline 高超过 threshold 的算回归
+    """
+    lines = []
+    regressed = False
+    for name in sorted(current['cases']):
+        if name not in baseline['cases']:
+            continue
+        for metric in throughput_metrics + memory_metrics:
+            if metric not in baseline['cases'][name]:
+                # 旧版本保存的结果中没有的指标
+                continue
+            old = baseline['cases'][name][metric]
+            new = current['cases'][name][metric]
+            # 内存增量可能是 0
+            ratio = float(new) / max(old, 1)
+            if metric in memory_metrics:
+                worse = ratio > 1 + threshold
+            else:
+                worse = ratio < 1 - threshold
+            flag = ''
+            if worse:
+                flag = '  REGRESSION'
+                regressed = True
+            lines.append('  %-18s %-22s %12.0f -> %12.0f (x%.2f)%s' % (name, metric, old, new, ratio, flag))
+    return lines, regressed
+
+
+def report(results):
+    lines = ['suite: commit %s, python %s, engine %s' % (results['commit'], results['python'],
+                                                          results['engine'])]
+    for name in sorted(results['cases']):
+        case = results['cases'][name]
+        lines.append('  %-18s %7d tokens  lex %9.0f tok/s  parse %8.0f tok/s  eval %8.0f stmt/s  +%6d KB' %
+                     (name, case['tokens'], case['lex_tokens_per_s'], case['parse_tokens_per_s'],
+                      case['eval_statements_per_s'], case['peak_rss_delta_kb']))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Imp lexer / parser / evaluator benchmark suite')
+    parser.add_argument('cases', nargs='*', help='case names, default all')
+    parser.add_argument('-o', '--output', help='save results as JSON')
+    parser.add_argument('--compare', help='baseline JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1)
+    parser.add_argument('-e', '--engine', choices=sorted(batch.engines), default='ast')
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    results = run_suite(args.engine, args.repeat, args.cases)
+    print report(results)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        lines, regressed = compare(baseline, results, args.threshold)
+        print 'compared with %s (commit %s):' % (args.compare, baseline.get('commit'))
+        print '\n'.join(lines)
+        if regressed:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+# encoding: utf-8
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from ast import *
+
+"""
+    向量化执行：同一个程序对一批初始 env (比如参数扫描的每一组参数) 一起执行，每一行 (lane) 是一个 env
+    每个变量是一个 numpy 数组，BinopAexp / RelopBexp 是数组运算，
+    IfStatement 用 mask 决定哪些行执行哪个分支，WhileStatement 一直循环到没有任何一行的条件还为真
+    还在循环的行少于四分之一时，把这些行抽出来 (compaction) 单独循环，已经结束的行不再陪着计算
+
+    结果与逐行调用 ast.eval 完全相同：
+    没有赋值过的变量读出 0，并且不出现在这一行的结果 env 中 (每个变量有一个 defined 数组)；
+    某一行除以 0 时抛出 ZeroDivisionError；
+    默认使用 int64，一旦有某一行的运算溢出，就改用 dtype=object (Python 整数) 从头重新执行
+
+    numpy 是可选依赖，没有安装时调用 run / evaluate_batch 会抛出 ImportError
+
+    用法：
+        envs = vectorized.evaluate_batch(ast, {'n': range(100000)})   # 每一行的最终 env
+"""
+
+INT64_MIN = -2 ** 63
+INT64_MAX = 2 ** 63 - 1
+
+
+class Overflow(Exception):
+    """
+        int64 运算溢出，run 截住之后改用 object 重新执行
+    """
+    pass
+
+
+class Lanes(object):
+    """
+        一批 env：values 是 变量名 -> 每一行的值，defined 是 变量名 -> 每一行是否赋值过
+        mask 为 None 表示全部的行
+    """
+    def __init__(self, size, dtype):
+        self.size = size
+        self.dtype = dtype
+        self.values = {}
+        self.defined = {}
+
+    def get(self, name):
+        values = self.values.get(name)
+        if values is None:
+            values = np.zeros(self.size, self.dtype)
+        return values
+
+    def assign(self, name, value, mask):
+        if np.ndim(value) == 0:
+            value = np.full(self.size, value, self.dtype)
+        if mask is None:
+            self.values[name] = value
+            self.defined[name] = np.ones(self.size, bool)
+            return
+        self.values[name] = np.where(mask, value, self.get(name))
+        defined = self.defined.get(name)
+        self.defined[name] = mask.copy() if defined is None else defined | mask
+
+    def subset(self, index):
+        lanes = Lanes(len(index), self.dtype)
+        for name in self.values:
+            lanes.values[name] = self.values[name][index]
+            lanes.defined[name] = self.defined[name][index]
+        return lanes
+
+    def update(self, index, lanes):
+        """
+            把 subset(index) 执行之后的结果写回；数组可能被几个变量共用 (x := y)，所以复制之后再写
+        """
+        for name in lanes.values:
+            values = self.get(name).copy()
+            defined = self.defined.get(name)
+            defined = np.zeros(self.size, bool) if defined is None else defined.copy()
+            values[index] = lanes.values[name]
+            defined[index] = lanes.defined[name]
+            self.values[name] = values
+            self.defined[name] = defined
+
+    def rows(self):
+        """
+            每一行的 env (dict)
+        """
+        envs = [{} for _ in xrange(self.size)]
+        for name in self.values:
+            values = self.values[name].tolist()
+            defined = self.defined[name].tolist()
+            for index in xrange(self.size):
+                if defined[index]:
+                    envs[index][name] = values[index]
+        return envs
+
+
+def active(flags, mask):
+    return flags if mask is None else flags & mask
+
+
+def checked(result, lanes, mask, overflow):
+    """
+        int64 时检查 mask 中的行是否溢出；两边都是常数时结果是 Python 整数，检查是否超出 int64 的范围
+    """
+    if np.ndim(result) == 0 and not isinstance(result, np.generic):
+        if not INT64_MIN <= result <= INT64_MAX:
+            raise Overflow()
+        return result
+    if np.any(active(overflow, mask)):
+        raise Overflow()
+    return result
+
+
+def eval_aexp(node, lanes, mask):
+    kind = node.__class__
+    if kind is IntAexp:
+        return node.i
+    if kind is VarAexp:
+        return lanes.get(node.name)
+    if kind is BinopAexp:
+        left = eval_aexp(node.left, lanes, mask)
+        right = eval_aexp(node.right, lanes, mask)
+        op = node.op
+        if np.ndim(left) == 0 and np.ndim(right) == 0:
+            # 两个常数
+            result = arith_binops[op](left, right)
+            return result if lanes.dtype is object else checked(result, lanes, mask, None)
+        if op == '/':
+            zero = right == 0
+            if np.any(active(zero, mask)):
+                raise ZeroDivisionError('integer division or modulo by zero')
+            if np.any(zero):
+                right = np.where(zero, 1, right)
+            result = np.floor_divide(left, right)
+        elif op in arith_binops:
+            result = arith_binops[op](left, right)
+        else:
+            raise RuntimeError('unknown operator: ' + op)
+        if lanes.dtype is object:
+            return result
+        if op == '+':
+            overflow = ((left ^ right) >= 0) & ((left ^ result) < 0)
+        elif op == '-':
+            overflow = ((left ^ right) < 0) & ((left ^ result) < 0)
+        elif op == '*':
+            divisor = np.where(right == 0, 1, right)
+            overflow = ((right != 0) & (result // divisor != left)) | \
+                ((left == INT64_MIN) & (right == -1))
+        else:
+            overflow = (left == INT64_MIN) & (right == -1)
+        return checked(result, lanes, mask, overflow)
+    raise TypeError('cannot vectorize %s' % kind.__name__)
+
+
+def eval_bexp(node, lanes, mask):
+    kind = node.__class__
+    if kind is RelopBexp:
+        left = eval_aexp(node.left, lanes, mask)
+        right = eval_aexp(node.right, lanes, mask)
+        return boolean_relops[node.op](left, right)
+    if kind is AndBexp:
+        return np.logical_and(eval_bexp(node.left, lanes, mask), eval_bexp(node.right, lanes, mask))
+    if kind is OrBexp:
+        return np.logical_or(eval_bexp(node.left, lanes, mask), eval_bexp(node.right, lanes, mask))
+    if kind is NotBexp:
+        return np.logical_not(eval_bexp(node.exp, lanes, mask))
+    raise TypeError('cannot vectorize %s' % kind.__name__)
+
+
+def branch(condition, lanes, mask):
+    """
+        condition 为真的行，返回 (是否有这样的行, 这些行的 mask)
+    """
+    if np.ndim(condition) == 0:
+        return bool(condition), mask
+    flags = active(condition, mask)
+    count = np.count_nonzero(flags)
+    if count == lanes.size:
+        return True, None
+    return count > 0, flags
+
+
+def execute(node, lanes, mask=None):
+    kind = node.__class__
+    if kind is AssignStatement:
+        lanes.assign(node.name, eval_aexp(node.aexp, lanes, mask), mask)
+    elif kind is Block:
+        for statement in node.statements:
+            execute(statement, lanes, mask)
+    elif kind is CompoundStatement:
+        execute(node.first, lanes, mask)
+        execute(node.second, lanes, mask)
+    elif kind is IfStatement:
+        condition = eval_bexp(node.condition, lanes, mask)
+        taken, true_mask = branch(condition, lanes, mask)
+        if taken:
+            execute(node.true_stmt, lanes, true_mask)
+        if node.false_stmt:
+            taken, false_mask = branch(np.logical_not(condition), lanes, mask)
+            if taken:
+                execute(node.false_stmt, lanes, false_mask)
+    elif kind is WhileStatement:
+        execute_while(node, lanes, mask)
+    else:
+        raise TypeError('cannot vectorize %s' % kind.__name__)
+
+
+def execute_while(node, lanes, mask):
+    while True:
+        running, mask = branch(eval_bexp(node.condition, lanes, mask), lanes, mask)
+        if not running:
+            return
+        if mask is not None and lanes.size > 64 and np.count_nonzero(mask) * 4 < lanes.size:
+            # 只剩少数几行还在循环，抽出来继续执行
+            index = np.flatnonzero(mask)
+            subset = lanes.subset(index)
+            execute_while(node, subset, None)
+            lanes.update(index, subset)
+            return
+        execute(node.body, lanes, mask)
+
+
+def run(stmt, columns, size=None, dtype=None):
+    """
+        columns 是 变量名 -> 每一行的初始值 (长度相同的序列)，size 是行数，没有 columns 时必须给出
+        返回执行之后的 Lanes；dtype 为 None 时先用 int64，溢出时改用 object
+    """
+    if np is None:
+        raise ImportError('vectorized evaluation requires numpy')
+    if size is None:
+        if not columns:
+            raise ValueError('size is required when columns is empty')
+        size = len(next(iter(columns.values())))
+    if dtype is None:
+        try:
+            return run(stmt, columns, size, np.int64)
+        except (Overflow, OverflowError):
+            return run(stmt, columns, size, object)
+    lanes = Lanes(size, dtype)
+    for name, column in columns.items():
+        values = np.array(column, dtype)
+        if values.shape != (size,):
+            raise ValueError('column %s has %d rows, expected %d' % (name, len(values), size))
+        lanes.values[name] = values
+        lanes.defined[name] = np.ones(size, bool)
+    with np.errstate(all='ignore'):
+        execute(stmt, lanes)
+    return lanes
+
+
+def evaluate_batch(stmt, columns, size=None, dtype=None):
+    """
+        返回每一行的最终 env 的 list，与对每一行 env = dict(初始值); stmt.eval(env) 的结果相同
+    """
+    return run(stmt, columns, size, dtype).rows()
+
+
+if __name__ == '__main__':
+    # 在生成的程序上与逐行 ast.eval 对比，初始值随机
+    import random
+    from generator import generate
+    from lexer import imp_lex
+    from primitive import imp_parse
+    rand = random.Random(0)
+    fallbacks = 0
+    for seed in range(200):
+        ast = imp_parse(imp_lex(generate(seed, statements=15, nesting=3))).value
+        size = rand.choice([1, 7, 100, 300])
+        columns = dict(('v%d' % index, [rand.randint(-10 ** 6, 10 ** 6) for _ in range(size)])
+                       for index in range(rand.randint(0, 5)))
+        expected = []
+        for row in range(size):
+            env = dict((name, column[row]) for name, column in columns.items())
+            ast.eval(env)
+            expected.append(env)
+        lanes = run(ast, columns, size)
+        fallbacks += lanes.dtype is object
+        assert lanes.rows() == expected, seed
+    print '200 programs match ast.eval (%d fell back to Python integers)' % fallbacks
@@ -0,0 +1,354 @@
+# encoding: utf-8
+
+from array import array
+
+from ast import *
+from slots import resolve
+
+"""
+    基于寄存器的字节码虚拟机
+    编译器把语法树编译为扁平的指令流，保存在紧凑的 array('i') 中，if / while 编译为跳转，
+    虚拟机用一个循环逐条分派执行，每条指令的开销是可预期的，编译好的程序也很容易缓存
+
+    每条指令固定 4 个整数：操作码 a b c
+    寄存器依次是：变量 (与 slots 一样按第一次出现的顺序分配)、常数、临时寄存器
+    常数寄存器在执行前装入，所以运算指令的操作数一律是寄存器
+
+    未赋值的变量寄存器初始为 UNSET，它是值为 0 的 int 子类对象：参与运算时就是 0，
+    运算结果是普通的 int，所以最后仍然是 UNSET 的变量就是没有被赋值过的，转回 dict 时不出现
+    唯一要注意的是变量之间的直接赋值 x := y，编译为 x = y + 0，保证 x 得到的是普通的 int
+"""
+
+
+class Unset(int):
+    def __repr__(self):
+        return 'UNSET'
+
+UNSET = Unset(0)
+
+opcodes = [
+    'ADD', 'SUB', 'MUL', 'DIV',         # a = b op c
+    'LT', 'LE', 'GT', 'GE', 'EQ', 'NE', # a = b op c
+    'AND', 'OR',                        # a = b and/or c，两边都已经求过值
+    'NOT',                              # a = not b
+    'MOV',                              # a = b
+    'JMP',                              # 跳转到 a
+    'JT', 'JF',                         # b 为真 / 为假时跳转到 a
+    'JLT', 'JLE', 'JGT', 'JGE', 'JEQ', 'JNE',   # b op c 成立时跳转到 a
+    'FAIL',                             # 未知操作符，b 是保存操作符的常数寄存器
+    'CHARGE',                           # 向常数寄存器 b 中的执行预算计入 c 步
+]
+for index, name in enumerate(opcodes):
+    globals()[name] = index
+
+arith_opcodes = {'+': ADD, '-': SUB, '*': MUL, '/': DIV}
+relop_opcodes = {'<': LT, '<=': LE, '>': GT, '>=': GE, '=': EQ, '!=': NE}
+jump_opcodes = {'<': JLT, '<=': JLE, '>': JGT, '>=': JGE, '=': JEQ, '!=': JNE}
+# 整数之间的比较是全序的，not (b < c) 等价于 b >= c
+negated_relops = {'<': '>=', '<=': '>', '>': '<=', '>=': '<', '=': '!=', '!=': '='}
+
+
+class Program:
+    """
+        编译好的程序：code 是指令流，names 是变量名，consts 是常数，registers 是寄存器总数
+        run / as_dict / eval 的用法与 slots.SlotProgram 相同
+    """
+    def __init__(self, code, names, consts, registers):
+        self.code = code
+        self.names = names
+        self.consts = consts
+        self.registers = registers
+
+    def new_env(self, env=None):
+        regs = [UNSET] * len(self.names) + self.consts
+        regs.extend([None] * (self.registers - len(regs)))
+        if env:
+            for index, name in enumerate(self.names):
+                if name in env:
+                    regs[index] = env[name]
+        return regs
+
+    def run(self, env=None):
+        regs = self.new_env(env)
+        execute(self.code, regs)
+        return regs
+
+    def as_dict(self, regs, env=None):
+        result = dict(env) if env else {}
+        for name, value in zip(self.names, regs):
+            if value is not UNSET:
+                result[name] = value
+        return result
+
+    def eval(self, env):
+        env.update(self.as_dict(self.run(env)))
+
+
+class Compiler:
+    def __init__(self, names):
+        self.names = names
+        self.variables = dict((name, index) for index, name in enumerate(names))
+        self.consts = []
+        self.const_registers = {}
+        self.code = array('i')
+        self.temps = 0
+        self.max_temps = 0
+
+    def emit(self, op, a=0, b=0, c=0):
+        self.code.extend((op, a, b, c))
+        return len(self.code) - 4
+
+    def patch(self, at, target):
+        self.code[at + 1] = target
+
+    def here(self):
+        return len(self.code)
+
+    def const(self, value):
+        key = (type(value), value)
+        if key not in self.const_registers:
+            self.const_registers[key] = len(self.names) + len(self.consts)
+            self.consts.append(value)
+        return self.const_registers[key]
+
+    def temp(self):
+        """
+            临时寄存器按栈的方式分配，用完由 release 归还；真正的寄存器号在编译结束后才确定
+        """
+        self.temps += 1
+        self.max_temps = max(self.max_temps, self.temps)
+        return -self.temps
+
+    def release(self, *registers):
+        for register in registers:
+            if register < 0:
+                self.temps -= 1
+
+    def aexp(self, node, dest=None):
+        """
+            编译表达式，返回保存结果的寄存器；给出 dest 时结果一定放到 dest 中
+        """
+        if isinstance(node, IntAexp):
+            register = self.const(node.i)
+        elif isinstance(node, VarAexp):
+            register = self.variables[node.name]
+            if dest is not None:
+                # x := y 要去掉 UNSET 标记，见模块说明
+                self.emit(ADD, dest, register, self.const(0))
+                return dest
+        elif isinstance(node, (BinopAexp, RelopBexp)):
+            table = arith_opcodes if isinstance(node, BinopAexp) else relop_opcodes
+            return self.binary(table.get(node.op), node, node.left, node.right, dest)
+        elif isinstance(node, AndBexp):
+            return self.binary(AND, node, node.left, node.right, dest)
+        elif isinstance(node, OrBexp):
+            return self.binary(OR, node, node.left, node.right, dest)
+        elif isinstance(node, NotBexp):
+            operand = self.aexp(node.exp)
+            self.release(operand)
+            register = dest if dest is not None else self.temp()
+            self.emit(NOT, register, operand)
+            return register
+        else:
+            raise RuntimeError('cannot compile node: %r' % node)
+        if dest is not None:
+            self.emit(MOV, dest, register)
+            return dest
+        return register
+
+    def binary(self, op, node, left, right, dest):
+        left = self.aexp(left)
+        right = self.aexp(right)
+        self.release(right, left)
+        register = dest if dest is not None else self.temp()
+        if op is None:
+            self.emit(FAIL, 0, self.const(node.op))
+        else:
+            self.emit(op, register, left, right)
+        return register
+
+    def jump_if(self, condition, when):
+        """
+            condition 的值为 when 时跳转，返回跳转指令的位置，目标地址之后再 patch
+            比较表达式直接编译为带比较的跳转指令
+        """
+        if isinstance(condition, RelopBexp) and condition.op in jump_opcodes:
+            op = condition.op if when else negated_relops[condition.op]
+            left = self.aexp(condition.left)
+            right = self.aexp(condition.right)
+            self.release(right, left)
+            return self.emit(jump_opcodes[op], 0, left, right)
+        register = self.aexp(condition)
+        self.release(register)
+        return self.emit(JT if when else JF, 0, register)
+
+    def stmt(self, node):
+        if isinstance(node, AssignStatement):
+            self.aexp(node.aexp, self.variables[node.name])
+        elif isinstance(node, Block):
+            for statement in node.statements:
+                self.stmt(statement)
+        elif isinstance(node, CompoundStatement):
+            self.stmt(node.first)
+            self.stmt(node.second)
+        elif isinstance(node, IfStatement):
+            skip_true = self.jump_if(node.condition, False)
+            self.stmt(node.true_stmt)
+            if node.false_stmt:
+                skip_false = self.emit(JMP)
+                self.patch(skip_true, self.here())
+                self.stmt(node.false_stmt)
+                self.patch(skip_false, self.here())
+            else:
+                self.patch(skip_true, self.here())
+        elif isinstance(node, ChargeStatement):
+            self.emit(CHARGE, 0, self.const(node.budget), node.steps)
+        elif isinstance(node, WhileStatement):
+            # 条件放在循环体后面，每次循环只需要一条跳转指令
+            to_condition = self.emit(JMP)
+            body = self.here()
+            self.stmt(node.body)
+            self.patch(to_condition, self.here())
+            self.patch(self.jump_if(node.condition, True), body)
+        else:
+            raise RuntimeError('cannot compile node: %r' % node)
+
+    def program(self, node):
+        self.stmt(node)
+        # 临时寄存器排在变量和常数之后
+        base = len(self.names) + len(self.consts) - 1
+        code = self.code
+        for at in range(0, len(code), 4):
+            op = code[at]
+            for offset in (1, 2, 3):
+                if code[at + offset] < 0 and not (offset == 1 and op >= JMP):
+                    code[at + offset] = base - code[at + offset]
+        registers = len(self.names) + len(self.consts) + self.max_temps
+        return Program(code, self.names, self.consts, registers)
+
+
+def compile_program(stmt):
+    return Compiler(resolve(stmt)).program(stmt)
+
+
+def execute(code, regs):
+    """
+        分派循环，按大致的出现频率排列操作码的判断顺序
+    """
+    pc = 0
+    end = len(code)
+    while pc < end:
+        op = code[pc]
+        a = code[pc + 1]
+        b = code[pc + 2]
+        c = code[pc + 3]
+        pc += 4
+        if op == 0:     # ADD
+            regs[a] = regs[b] + regs[c]
+        elif op == 17:  # JLT
+            if regs[b] < regs[c]:
+                pc = a
+        elif op == 20:  # JGE
+            if regs[b] >= regs[c]:
+                pc = a
+        elif op == 1:   # SUB
+            regs[a] = regs[b] - regs[c]
+        elif op == 2:   # MUL
+            regs[a] = regs[b] * regs[c]
+        elif op == 3:   # DIV
+            regs[a] = regs[b] / regs[c]
+        elif op == 24:  # CHARGE，即 budget.charge(c)，展开以省去一次方法调用
+            budget = regs[b]
+            budget.steps += c
+            if budget.steps >= budget.next_check:
+                budget.check()
+        elif op == 14:  # JMP
+            pc = a
+        elif op == 13:  # MOV
+            regs[a] = regs[b]
+        elif op == 18:  # JLE
+            if regs[b] <= regs[c]:
+                pc = a
+        elif op == 19:  # JGT
+            if regs[b] > regs[c]:
+                pc = a
+        elif op == 21:  # JEQ
+            if regs[b] == regs[c]:
+                pc = a
+        elif op == 22:  # JNE
+            if regs[b] != regs[c]:
+                pc = a
+        elif op == 15:  # JT
+            if regs[b]:
+                pc = a
+        elif op == 16:  # JF
+            if not regs[b]:
+                pc = a
+        elif op == 4:   # LT
+            regs[a] = regs[b] < regs[c]
+        elif op == 5:   # LE
+            regs[a] = regs[b] <= regs[c]
+        elif op == 6:   # GT
+            regs[a] = regs[b] > regs[c]
+        elif op == 7:   # GE
+            regs[a] = regs[b] >= regs[c]
+        elif op == 8:   # EQ
+            regs[a] = regs[b] == regs[c]
+        elif op == 9:   # NE
+            regs[a] = regs[b] != regs[c]
+        elif op == 10:  # AND
+            regs[a] = regs[b] and regs[c]
+        elif op == 11:  # OR
+            regs[a] = regs[b] or regs[c]
+        elif op == 12:  # NOT
+            regs[a] = not regs[b]
+        elif op == 23:  # FAIL
+            raise RuntimeError('unknown operator: ' + regs[b])
+        else:
+            raise RuntimeError('unknown opcode: %d' % op)
+
+
+def disassemble(program):
+    """
+        反汇编，每行一条指令；变量显示为变量名，常数显示为 #值，临时寄存器显示为 t序号
+    """
+    names = program.names
+    consts = program.consts
+
+    def register(index):
+        if index < len(names):
+            return names[index]
+        if index < len(names) + len(consts):
+            return '#%r' % consts[index - len(names)]
+        return 't%d' % (index - len(names) - len(consts))
+
+    lines = []
+    code = program.code
+    for at in range(0, len(code), 4):
+        op, a, b, c = code[at:at + 4]
+        name = opcodes[op]
+        if op == JMP:
+            operands = '%04d' % a
+        elif op in (JT, JF):
+            operands = '%04d, %s' % (a, register(b))
+        elif op >= JLT and op <= JNE:
+            operands = '%04d, %s, %s' % (a, register(b), register(c))
+        elif op in (NOT, MOV):
+            operands = '%s, %s' % (register(a), register(b))
+        elif op == FAIL:
+            operands = register(b)
+        elif op == CHARGE:
+            operands = '%s, %d' % (register(b), c)
+        else:
+            operands = '%s, %s, %s' % (register(a), register(b), register(c))
+        lines.append('%04d %-4s %s' % (at, name, operands))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    from lexer import imp_lex
+    from primitive import imp_parse
+    text = 'n := 10; i := 0; while i < n do if i / 2 * 2 = i then s := s + i * 2 end; i := i + 1 end'
+    program = compile_program(imp_parse(imp_lex(text)).value)
+    print disassemble(program)
+    print program.as_dict(program.run())